@@ -0,0 +1,213 @@
+import time
+from contextlib import contextmanager
+
+
+###############################################################################
+class AdaptiveScheduler():
+    """This class keeps the per frame latency within a budget by lowering the quality of the work done on each frame.
+       The quality levels go from the full quality (level 0) to the cheapest one, each level is a
+       (scale, skipped layers, inference interval) tuple:
+       scale : working resolution relative to the camera resolution
+       skipped layers : expensive overlay layers (e.g. the tessellation 'mesh') that are not drawn
+       inference interval : the landmarks are inferred every interval frames and reused by the frames in between
+
+       The caller times the stages of every frame (stage), the scheduler keeps a moving average of each stage cost.
+       The inference cost does not depend on the working resolution and is shared by the frames of an inference interval,
+       the fixed stages (e.g. a conversion done at the camera resolution) do not depend on it either,
+       the cost of the other stages is proportional to the number of pixels of the working resolution.
+       A level is left for a cheaper one as soon as the measured latency exceeds the budget, and a better level
+       is recovered once its predicted cost fits the budget with some headroom for several frames in a row.
+       Every decision is counted in counters.
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self, budget = 1 / 30, scales = (1.0, 0.75, 0.5), max_reuse = 2, expensive_layers = ('mesh',),
+                 levels = None, fixed_stages = (), smoothing = 0.2, headroom = 0.8, patience = 30, settle = 3, probe = 10):
+        """AdaptiveScheduler parameters:
+           budget : per frame latency budget (seconds)
+           scales : working resolutions relative to the camera resolution, from the best to the lowest
+           max_reuse : maximum number of frames reusing the landmarks of the last inference
+           expensive_layers : overlay layers dropped before reusing landmarks or lowering the resolution
+           levels : explicit list of (scale, skipped layers, inference interval) levels, built from the above by default
+           fixed_stages : names of the stages working at the camera resolution, whose cost does not depend on the scale
+           smoothing : weight of the last measure in the moving averages
+           headroom : fraction of the budget the predicted cost of a better level must fit in
+           patience : number of frames in a row a better level must fit before it is recovered
+           settle : number of frames measured at a level before leaving it for a cheaper one
+           probe : the better level is tried after probe * patience frames within the headroom, even if predicted too slow
+        """
+
+        if levels is None:
+            levels = [(scales[0], (), 1), (scales[0], tuple(expensive_layers), 1)]
+            levels += [(scales[0], tuple(expensive_layers), reuse + 1) for reuse in range(1, max_reuse + 1)]
+            levels += [(scale, tuple(expensive_layers), max_reuse + 1) for scale in scales[1:]]
+
+        # identical successive levels (e.g. without expensive layers) are dropped
+        self.levels = []
+        for scale, skipped, interval in levels:
+            level = (scale, frozenset(skipped), interval)
+            if not self.levels or self.levels[-1] != level:
+                self.levels.append(level)
+
+        self.budget       = budget
+        self.fixed_stages = frozenset(fixed_stages)
+        self.smoothing    = smoothing
+        self.headroom     = headroom
+        self.patience     = patience
+        self.settle       = settle
+        self.probe        = probe
+
+        self.level        = 0
+        self.level_frames = 0       # frames measured since the level changed
+        self.calm_frames  = 0       # frames in a row the better level fitted the budget
+        self.latency      = None    # moving average of the frame latency at the current level
+        self.costs        = {}      # moving average of the stage costs, per (stage, skipped layers), at scale 1.0
+        self.reused       = 0       # frames in a row that reused the landmarks
+
+        self.frame_start  = None
+        self.frame_stages = {}
+        self.plan         = None
+
+        self.counters = {'frames': 0, 'late_frames': 0, 'inferences': 0, 'reused_landmarks': 0,
+                         'skipped_layers': 0, 'downscaled': 0, 'degrades': 0, 'upgrades': 0}
+
+#------------------------------------------------------------------------------
+    def start_frame(self, frame_size, reusable = True):
+        """This method starts timing a frame of the given camera (width, height) and returns its plan:
+           'infer' : True to run the inference, False to reuse the landmarks of the last inference
+           'size' : (width, height) working resolution, None to keep the camera resolution
+           'skip_layers' : set of overlay layers not to draw
+           'level' : current quality level
+           reusable tells whether landmarks of a previous frame are available
+        """
+        scale, skipped, interval = self.levels[self.level]
+
+        infer = not reusable or self.reused + 1 >= interval
+        self.reused = 0 if infer else self.reused + 1
+
+        width, height = frame_size
+        size          = None if scale == 1.0 else (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+
+        self.counters['frames'] += 1
+        self.counters['inferences' if infer else 'reused_landmarks'] += 1
+        self.counters['skipped_layers'] += bool(skipped)
+        self.counters['downscaled']     += size is not None
+
+        self.plan         = {'infer': infer, 'size': size, 'skip_layers': skipped, 'level': self.level}
+        self.frame_stages = {}
+        self.frame_start  = time.perf_counter()
+        return self.plan
+
+#------------------------------------------------------------------------------
+    @contextmanager
+    def stage(self, name):
+        """This method times the enclosed stage of the current frame ('inference' or any other name),
+           the times of a stage repeated in the same frame add up
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.frame_stages[name] = self.frame_stages.get(name, 0.0) + time.perf_counter() - start
+
+#------------------------------------------------------------------------------
+    def end_frame(self):
+        """This method ends the current frame, updates the stage costs and chooses the level of the next frame.
+           It returns the frame latency (seconds)
+        """
+        latency = time.perf_counter() - self.frame_start
+        scale   = self.levels[self.plan['level']][0]
+        skipped = self.plan['skip_layers']
+
+        # the time not spent in a timed stage is a stage of its own
+        self.frame_stages['other'] = max(latency - sum(self.frame_stages.values()), 0.0)
+
+        for name, cost in self.frame_stages.items():
+            # the inference and the fixed stages barely depend on the resolution, the other stages are proportional to the pixels
+            key = 'inference' if name == 'inference' else (name, skipped)
+            if name != 'inference' and name not in self.fixed_stages:
+                cost /= scale ** 2
+            self.costs[key] = self.average(self.costs.get(key), cost)
+
+        self.latency = self.average(self.latency, latency)
+        self.counters['late_frames'] += latency > self.budget
+        self.level_frames            += 1
+
+        self.choose_level()
+        return latency
+
+#------------------------------------------------------------------------------
+    def average(self, average, value):
+        """This method returns the moving average updated with value
+        """
+        if average is None:
+            return value
+        return average + self.smoothing * (value - average)
+
+#------------------------------------------------------------------------------
+    def predict(self, level):
+        """This method returns the predicted frame latency of the given level from the measured stage costs
+        """
+        scale, skipped, interval = self.levels[level]
+
+        predicted = 0.0
+        for name in {key[0] for key in self.costs if key != 'inference'}:
+            cost = self.costs.get((name, skipped))
+            if cost is None:
+                # not measured with these layers yet, the most expensive measure is used
+                cost = max(value for key, value in self.costs.items() if key != 'inference' and key[0] == name)
+            predicted += cost if name in self.fixed_stages else cost * scale ** 2
+
+        if 'inference' in self.costs:
+            predicted += self.costs['inference'] / interval
+        return predicted
+
+#------------------------------------------------------------------------------
+    def choose_level(self):
+        """This method degrades the level when the measured latency exceeds the budget,
+           and recovers the better level when its predicted latency fitted the budget for patience frames.
+           The costs of the better level may have been measured under a heavier load, so it is also tried
+           after probe * patience frames well within the budget
+        """
+        if self.latency > self.budget:
+            self.calm_frames = 0
+            if self.level_frames >= self.settle and self.level < len(self.levels) - 1:
+                self.set_level(self.level + 1)
+                self.counters['degrades'] += 1
+
+        elif self.level > 0 and self.latency <= self.headroom * self.budget:
+            self.calm_frames += 1
+            fits              = self.predict(self.level - 1) <= self.headroom * self.budget
+            if (fits and self.calm_frames >= self.patience) or self.calm_frames >= self.probe * self.patience:
+                self.set_level(self.level - 1)
+                self.counters['upgrades'] += 1
+
+        else:
+            self.calm_frames = 0
+
+#------------------------------------------------------------------------------
+    def set_level(self, level):
+        """This method moves to the given level and restarts its latency measure
+        """
+        self.level        = level
+        self.level_frames = 0
+        self.calm_frames  = 0
+        self.latency      = None
+
+#------------------------------------------------------------------------------
+    def report(self):
+        """This method returns the counters, the current level and the measured costs (milliseconds) as a dictionary
+        """
+        scale, skipped, interval = self.levels[self.level]
+
+        costs = {}
+        for key, cost in self.costs.items():
+            name = key if key == 'inference' else key[0] + ''.join(' -' + layer for layer in sorted(key[1]))
+            costs[name] = round(cost * 1000, 3)
+
+        return {'counters':   dict(self.counters),
+                'level':      {'index': self.level, 'scale': scale, 'skipped_layers': sorted(skipped),
+                               'inference_interval': interval},
+                'budget_ms':  round(self.budget * 1000, 3),
+                'latency_ms': None if self.latency is None else round(self.latency * 1000, 3),
+                'costs_ms':   costs}
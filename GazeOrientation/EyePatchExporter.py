@@ -0,0 +1,300 @@
+import json
+import numpy as np
+import cv2
+from GazeOrientation.GazeTracking import GazeEstimation
+from GazeOrientation.LandmarkBackends import MediaPipeBackend
+
+
+# one label per exported frame, pupils positions are (x, y) pixels, ratios are NaN when they could not be computed
+LABEL_DTYPE = np.dtype([
+    ('source',            np.int32),       # index of the video / image source (see the _sources.json file)
+    ('frame',             np.int64),       # frame index inside the video source
+    ('left_pupil',        np.float32, 2),  # pupil centre in the source image
+    ('right_pupil',       np.float32, 2),
+    ('left_pupil_patch',  np.float32, 2),  # pupil centre in the eye patch
+    ('right_pupil_patch', np.float32, 2),
+    ('hori_ratio',        np.float32),
+    ('vert_ratio',        np.float32),
+    ('blink_ratio_left',  np.float32),
+    ('blink_ratio_right', np.float32),
+    ('blinking',          np.int8)])       # -1 eyes open, 0 left eye, 1 both eyes, 2 right eye blinking
+
+
+###############################################################################
+class GrowingNpyArray():
+    """This class appends items to a memory-mapped .npy file that grows in chunks.
+       The header is written with a fixed size so that it can be rewritten in place when the file grows,
+       the file is always a valid .npy file (the rows after the last appended item are zeros until close).
+    """
+
+    magic = b'\x93NUMPY\x01\x00'
+
+#------------------------------------------------------------------------------
+    def __init__(self, path, item_shape, dtype, chunk_size = 1024):
+        """GrowingNpyArray creates (or overwrites) the .npy file at path for items of the given shape and dtype
+        """
+
+        self.path       = path
+        self.item_shape = tuple(item_shape)
+        self.dtype      = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.count      = 0
+        self.capacity   = 0
+        self.array      = None
+
+        # room for the largest possible shape so the header never has to move
+        largest          = self.header_text(np.iinfo(np.int64).max)
+        self.header_size = -(-(len(self.magic) + 2 + len(largest) + 1) // 64) * 64
+
+        self.file = open(path, 'w+b')
+        self.grow()
+
+#------------------------------------------------------------------------------
+    def header_text(self, length):
+        """This method returns the header dictionary text of an array of the given length
+        """
+        return repr({'descr':         np.lib.format.dtype_to_descr(self.dtype),
+                     'fortran_order': False,
+                     'shape':         (length,) + self.item_shape})
+
+#------------------------------------------------------------------------------
+    def write_header(self, length):
+        """This method rewrites the fixed size header for an array of the given length
+        """
+        text = self.header_text(length)
+        text = text + ' ' * (self.header_size - len(self.magic) - 2 - len(text) - 1) + '\n'
+
+        self.file.seek(0)
+        self.file.write(self.magic + np.uint16(len(text)).tobytes() + text.encode('latin1'))
+        self.file.flush()
+
+#------------------------------------------------------------------------------
+    def grow(self):
+        """This method extends the file by one chunk and remaps it
+        """
+        if self.array is not None:
+            self.array.flush()
+            self.array = None
+
+        self.capacity += self.chunk_size
+        self.write_header(self.capacity)
+        self.file.truncate(self.header_size + self.capacity * self.dtype.itemsize * int(np.prod(self.item_shape)))
+
+        self.array = np.memmap(self.file, dtype = self.dtype, mode = 'r+', offset = self.header_size,
+                               shape = (self.capacity,) + self.item_shape)
+
+#------------------------------------------------------------------------------
+    def append(self):
+        """This method returns the index and the writable view of a new item
+        """
+        if self.count == self.capacity:
+            self.grow()
+
+        self.count += 1
+        return self.count - 1, self.array[self.count - 1]
+
+#------------------------------------------------------------------------------
+    def close(self):
+        """This method trims the file to the appended items and closes it
+        """
+        if self.file.closed:
+            return
+
+        self.array.flush()
+        self.array = None
+
+        self.write_header(self.count)
+        self.file.truncate(self.header_size + self.count * self.dtype.itemsize * int(np.prod(self.item_shape)))
+        self.file.close()
+
+
+###############################################################################
+class EyePatchExporter():
+    """This class builds an eye patches dataset from video and image sources in a streaming run.
+       Both eyes of every frame with a detected face are cropped to a fixed size patch, aligned on the eye corners,
+       and appended to the memory-mapped <prefix>_patches.npy array of shape (N, 2, height, width[, 3])
+       (index 0 is the left eye, index 1 the right eye). The parallel <prefix>_labels.npy structured array
+       holds the pupils positions, gaze ratios and blink state (see LABEL_DTYPE).
+       Both arrays can be loaded without copying with load_eye_patches.
+    """
+
+    # (inner corner, outer corner) landmarks of the left and right eyes, see get_eyes_boundingbox
+    eyes_corners = ((362, 263), (133, 33))
+
+#------------------------------------------------------------------------------
+    def __init__(self, output_prefix, patch_size = (36, 60), grayscale = False, eye_width_ratio = 0.7,
+                 chunk_size = 1024, backend = None, cache = None):
+        """EyePatchExporter parameters:
+           output_prefix : path prefix of the .npy and .json output files
+           patch_size : (height, width) of the eye patches
+           grayscale : True to store single channel patches
+           eye_width_ratio : distance between the eye corners relative to the patch width
+           chunk_size : number of frames the files grow by
+           backend : landmark backend, by default a tracking MediaPipeBackend is used for videos
+                     and a static one for images
+           cache : optional ResultCache (e.g. a PersistentResultCache) reusing the landmarks of the frames
+                   exported by a previous run
+        """
+
+        self.output_prefix   = output_prefix
+        self.patch_size      = tuple(patch_size)
+        self.grayscale       = grayscale
+        self.eye_width_ratio = eye_width_ratio
+        self.backend         = backend
+        self.cache           = cache
+        self.backends        = {}
+        self.sources         = []
+
+        patch_shape  = (2,) + self.patch_size + (() if grayscale else (3,))
+        self.patches = GrowingNpyArray(output_prefix + '_patches.npy', patch_shape, np.uint8, chunk_size)
+        self.labels  = GrowingNpyArray(output_prefix + '_labels.npy', (), LABEL_DTYPE, chunk_size)
+
+#------------------------------------------------------------------------------
+    def get_backend(self, static_image_mode):
+        """This method returns the landmark backend used for videos (tracking) or images (static)
+        """
+        if self.backend is not None:
+            return self.backend
+
+        if static_image_mode not in self.backends:
+            self.backends[static_image_mode] = MediaPipeBackend(static_image_mode = static_image_mode)
+        return self.backends[static_image_mode]
+
+#------------------------------------------------------------------------------
+    def eye_transform(self, landmarks, corners, shape):
+        """This method returns the 2x3 affine matrix mapping the image to the aligned patch of one eye
+        """
+        height, width = shape[:2]
+        inner, outer  = corners
+
+        # the patch x axis goes from the left-most corner to the right-most corner of the eye
+        points = landmarks[[inner, outer], :2] * (width, height)
+        points = points[np.argsort(points[:, 0])]
+
+        dx, dy = points[1] - points[0]
+        centre = points.mean(axis=0)
+        scale  = self.eye_width_ratio * self.patch_size[1] / max(np.hypot(dx, dy), 1e-6)
+
+        transform        = cv2.getRotationMatrix2D((float(centre[0]), float(centre[1])), np.degrees(np.arctan2(dy, dx)), scale)
+        transform[:, 2] += (self.patch_size[1] / 2 - centre[0], self.patch_size[0] / 2 - centre[1])
+        return transform
+
+#------------------------------------------------------------------------------
+    def add(self, image, source = -1, frame = 0, backend = None):
+        """This method appends the eye patches and the labels of one BGR image,
+           it returns False if no face was detected in the image
+        """
+        estimate_gaze = GazeEstimation(image, backend = backend if backend is not None else self.get_backend(True),
+                                       cache = self.cache)
+        landmarks     = estimate_gaze.get_landmarks_array()
+
+        if landmarks is None:
+            return False
+
+        left_pupil  = estimate_gaze.get_left_pupil_centre()
+        right_pupil = estimate_gaze.get_right_pupil_centre()
+        hori_ratio, vert_ratio, blink_ratio_left_eye, blink_ratio_right_eye = estimate_gaze.get_gaze_ratios()
+        _, blinking_condition, _, _ = estimate_gaze.classify_gaze_direction()
+
+        if self.grayscale:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        _, patches = self.patches.append()
+        _, label   = self.labels.append()
+
+        for k, (corners, pupil) in enumerate(zip(self.eyes_corners, (left_pupil, right_pupil))):
+            transform = self.eye_transform(landmarks, corners, image.shape)
+
+            # the patch is warped straight into the memory-mapped array
+            cv2.warpAffine(image, transform, self.patch_size[::-1], dst = patches[k],
+                           flags = cv2.INTER_LINEAR, borderMode = cv2.BORDER_REPLICATE)
+
+            name = ('left_pupil', 'right_pupil')[k]
+            if pupil[0] != []:
+                label[name]            = pupil
+                label[name + '_patch'] = transform[:, :2] @ pupil + transform[:, 2]
+            else:
+                label[name]            = np.nan
+                label[name + '_patch'] = np.nan
+
+        label['source'] = source
+        label['frame']  = frame
+        for key, value in (('hori_ratio',        hori_ratio),
+                           ('vert_ratio',        vert_ratio),
+                           ('blink_ratio_left',  blink_ratio_left_eye),
+                           ('blink_ratio_right', blink_ratio_right_eye)):
+            label[key] = np.nan if value is None else value
+        label['blinking'] = blinking_condition
+        return True
+
+#------------------------------------------------------------------------------
+    def export_video(self, path, step = 1):
+        """This method exports every step-th frame of the video file (or camera index), it returns the number of frames exported
+        """
+        source  = len(self.sources)
+        backend = self.get_backend(False)
+        video   = cv2.VideoCapture(path)
+        self.sources.append(str(path))
+
+        exported = 0
+        frame    = 0
+        while True:
+            success, image = video.read()
+            if not success:
+                break
+            if frame % step == 0:
+                exported += self.add(image, source, frame, backend)
+            frame += 1
+
+        video.release()
+        return exported
+
+#------------------------------------------------------------------------------
+    def export_images(self, paths):
+        """This method exports the image files, it returns the number of images exported
+        """
+        backend  = self.get_backend(True)
+        exported = 0
+
+        for path in paths:
+            image = cv2.imread(path)
+            if image is None:
+                print("Ignoring unreadable image:", path)
+                continue
+
+            self.sources.append(str(path))
+            exported += self.add(image, len(self.sources) - 1, 0, backend)
+        return exported
+
+#------------------------------------------------------------------------------
+    def close(self):
+        """This method trims the output arrays, writes the sources file and returns the number of exported frames
+        """
+        self.patches.close()
+        self.labels.close()
+
+        with open(self.output_prefix + '_sources.json', 'w') as sources_file:
+            json.dump({'sources':         self.sources,
+                       'patch_size':      self.patch_size,
+                       'grayscale':       self.grayscale,
+                       'eye_width_ratio': self.eye_width_ratio}, sources_file, indent = 4)
+
+        for backend in self.backends.values():
+            backend.close()
+        self.backends = {}
+        return self.labels.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+#------------------------------------------------------------------------------
+def load_eye_patches(output_prefix):
+    """This function returns the (patches, labels) memory-mapped arrays written by an EyePatchExporter
+    """
+    patches = np.load(output_prefix + '_patches.npy', mmap_mode = 'r')
+    labels  = np.load(output_prefix + '_labels.npy',  mmap_mode = 'r')
+    return patches, labels
@@ -0,0 +1,135 @@
+import weakref
+import numpy as np
+import cv2
+import mediapipe as mp
+
+
+# colours and thicknesses of the mediapipe default face mesh drawing styles
+GRAY                  = (128, 128, 128)
+WHITE                 = (224, 224, 224)
+GREEN                 = (48, 255, 48)
+RED                   = (48, 48, 255)
+THICKNESS_TESSELATION = 1
+THICKNESS_CONTOURS    = 2
+
+
+###############################################################################
+class FaceMeshRenderer():
+    """This class draws the face mesh layers (mesh, contours, irises, eyes contours)
+       from a (478, 3) normalised landmarks array.
+       The connection sets are converted once to NumPy index arrays grouped by drawing style,
+       the landmarks are projected to pixels in one vectorized step and
+       each style group is drawn with a single cv2.polylines call.
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self):
+        """FaceMeshRenderer precomputes the connection index arrays of every layer
+        """
+        mp_face_mesh = mp.solutions.face_mesh
+
+        # every layer is a list of (connections index array of shape (E, 2), colour, thickness) style groups
+        layers = {
+            'mesh':     [([mp_face_mesh.FACEMESH_TESSELATION], GRAY, THICKNESS_TESSELATION)],
+
+            'contours': [([mp_face_mesh.FACEMESH_LIPS, mp_face_mesh.FACEMESH_FACE_OVAL],          WHITE, THICKNESS_CONTOURS),
+                         ([mp_face_mesh.FACEMESH_LEFT_EYE, mp_face_mesh.FACEMESH_LEFT_EYEBROW],   GREEN, THICKNESS_CONTOURS),
+                         ([mp_face_mesh.FACEMESH_RIGHT_EYE, mp_face_mesh.FACEMESH_RIGHT_EYEBROW], RED,   THICKNESS_CONTOURS)],
+
+            'irises':   [([mp_face_mesh.FACEMESH_LEFT_IRIS],  GREEN, THICKNESS_CONTOURS),
+                         ([mp_face_mesh.FACEMESH_RIGHT_IRIS], RED,   THICKNESS_CONTOURS)],
+
+            'eyes':     [([mp_face_mesh.FACEMESH_LEFT_EYE],  GREEN, THICKNESS_CONTOURS),
+                         ([mp_face_mesh.FACEMESH_RIGHT_EYE], RED,   THICKNESS_CONTOURS)],
+        }
+
+        self.layers = {}
+        for name, groups in layers.items():
+            self.layers[name] = [(np.array(sorted(set().union(*connections)), dtype=np.int32), color, thickness)
+                                 for connections, color, thickness in groups]
+
+        # (weak reference to the out buffer, face region drawn into it) of the dirty_only renders, per buffer id
+        self.dirty_regions = {}
+
+#------------------------------------------------------------------------------
+    def project(self, landmarks, shape):
+        """This method returns the (478, 2) pixel coordinates of the landmarks and a mask of the landmarks inside the image
+        """
+        height, width = shape[:2]
+        points        = landmarks[:, :2] * (width, height)
+        inside        = ((landmarks[:, :2] >= 0) & (landmarks[:, :2] <= 1)).all(axis=1)
+
+        points = np.minimum(np.floor(points), (width - 1, height - 1)).astype(np.int32)
+        return points, inside
+
+#------------------------------------------------------------------------------
+    def face_region(self, points, inside, shape, margin = 4):
+        """This method returns the (xmin, ymin, xmax, ymax) pixel box enclosing the projected landmarks,
+           extended by margin pixels to cover the line thickness
+        """
+        height, width = shape[:2]
+        xmin, ymin    = points[inside].min(axis=0) - margin
+        xmax, ymax    = points[inside].max(axis=0) + margin + 1
+
+        return max(xmin, 0), max(ymin, 0), min(xmax, width), min(ymax, height)
+
+#------------------------------------------------------------------------------
+    def swap_dirty_region(self, out, region):
+        """This method records the face region drawn into the out buffer and returns the one of its previous render
+        """
+        key = id(out)
+
+        previous = self.dirty_regions.get(key)
+        previous = previous[1] if previous is not None and previous[0]() is out else None
+
+        # the entry is removed when the buffer is released, so that a new buffer never gets its region
+        self.dirty_regions[key] = (weakref.ref(out, lambda reference: self.dirty_regions.pop(key, None)), region)
+        return previous
+
+#------------------------------------------------------------------------------
+    def render(self, image, landmarks, layers, out = None, dirty_only = False):
+        """This method returns the image with the given layers ('mesh', 'contours', 'irises', 'eyes') drawn over it.
+           The drawing is done into the out buffer (a new copy of the image by default, out may be the image itself).
+           With dirty_only, only the face regions of this render and of the previous render into the same out buffer
+           are refreshed from the image (erasing the lines drawn by the previous render), the rest of out is left untouched
+        """
+        if out is None:
+            out = image.copy()
+        elif out is not image and not dirty_only:
+            np.copyto(out, image)
+
+        region = None
+        if landmarks is not None and len(landmarks) > 0:
+            points, inside = self.project(landmarks, image.shape)
+            if inside.any():
+                region = self.face_region(points, inside, image.shape)
+
+        if dirty_only and out is not image:
+            previous = self.swap_dirty_region(out, region)
+            boxes    = [box for box in (previous, region) if box is not None]
+            if boxes:
+                xmin, ymin = min(box[0] for box in boxes), min(box[1] for box in boxes)
+                xmax, ymax = max(box[2] for box in boxes), max(box[3] for box in boxes)
+                np.copyto(out[ymin:ymax, xmin:xmax], image[ymin:ymax, xmin:xmax])
+
+        if region is None:
+            return out
+
+        if dirty_only:
+            xmin, ymin, xmax, ymax = region
+            canvas = out[ymin:ymax, xmin:xmax]
+            points = points - (xmin, ymin)
+        else:
+            canvas = out
+
+        for layer in layers:
+            for connections, color, thickness in self.layers[layer]:
+                # skip the connections with an end point outside the image, as mediapipe drawing_utils does
+                connections = connections[inside[connections].all(axis=1)]
+                cv2.polylines(canvas, points[connections], False, color, thickness)
+        return out
+
+
+#------------------------------------------------------------------------------
+# renderer shared by the GazeEstimation objects
+default_renderer = FaceMeshRenderer()
@@ -0,0 +1,161 @@
+import time
+import queue
+import threading
+
+
+# gaze direction texts (see GazeEstimation.classify_gaze_direction) that describe a blink
+BLINKING_DIRECTIONS = ("Left eye is blinking", "Boths eyes are blinking", "Right eye is blinking")
+BLINKING_EYES       = ("left", "both", "right")
+
+# numeric fields of the gaze record compared against epsilon, and pixel fields compared against pixel_epsilon
+RATIO_KEYS = ('hori_ratio', 'vert_ratio', 'blink_ratio_left', 'blink_ratio_right')
+PUPIL_KEYS = ('left_pupil', 'right_pupil')
+
+
+###############################################################################
+class GazeEventEmitter():
+    """This class turns the stream of per frame gaze records (see GazeEstimation.get_gaze_record)
+       into a stream of change-only events:
+       transition events : the debounced gaze direction changed, with the dwell duration of the previous direction
+       blink_start / blink_end events : a blink started or ended, with the blink duration
+       delta events : only the numeric values that moved beyond epsilon since they were last emitted
+
+       Events are dictionaries passed to the optional callback and to every subscribed queue.
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self, callback = None, debounce = 0.1, epsilon = 0.02, pixel_epsilon = 2):
+        """GazeEventEmitter parameters:
+           callback : function called with every event
+           debounce : seconds a new gaze direction must last before a transition is emitted
+           epsilon : minimum change of a ratio to emit it in a delta event
+           pixel_epsilon : minimum change (in pixels) of a pupil centre to emit it in a delta event
+        """
+
+        self.callback      = callback
+        self.debounce      = debounce
+        self.epsilon       = epsilon
+        self.pixel_epsilon = pixel_epsilon
+
+        self.direction       = None    # current debounced gaze direction
+        self.direction_since = None
+        self.candidate       = None    # gaze direction waiting for the debounce delay
+        self.candidate_since = None
+        self.last_values     = {}      # last emitted numeric values
+
+        self.subscribers = []
+        self.lock        = threading.Lock()
+        self.counters    = {'records': 0, 'transitions': 0, 'blinks': 0, 'deltas': 0}
+
+#------------------------------------------------------------------------------
+    def update(self, record, timestamp = None):
+        """This method feeds one gaze record and returns the list of events it produced
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.lock:
+            self.counters['records'] += 1
+            events = self.direction_events(record['direction'], timestamp) + self.delta_events(record, timestamp)
+
+        for event in events:
+            self.emit(event)
+        return events
+
+#------------------------------------------------------------------------------
+    def direction_events(self, direction, timestamp):
+        """This method returns the transition and blink events of the debounced gaze direction
+        """
+        if direction == self.direction:
+            self.candidate = None
+            return []
+
+        if direction != self.candidate:
+            self.candidate       = direction
+            self.candidate_since = timestamp
+
+        if timestamp - self.candidate_since < self.debounce:
+            return []
+
+        # the candidate direction lasted longer than the debounce delay
+        previous, previous_since = self.direction, self.direction_since
+        since                    = self.candidate_since
+        dwell                    = since - previous_since if previous is not None else None
+
+        self.direction, self.direction_since = self.candidate, since
+        self.candidate                       = None
+        self.counters['transitions']        += 1
+
+        events = [{'type': 'transition', 'time': since, 'from': previous, 'to': direction, 'dwell': dwell}]
+
+        if direction in BLINKING_DIRECTIONS and previous not in BLINKING_DIRECTIONS:
+            self.counters['blinks'] += 1
+            events.append({'type': 'blink_start', 'time': since,
+                           'eye': BLINKING_EYES[BLINKING_DIRECTIONS.index(direction)]})
+
+        elif previous in BLINKING_DIRECTIONS and direction not in BLINKING_DIRECTIONS:
+            events.append({'type': 'blink_end', 'time': since, 'duration': dwell})
+        return events
+
+#------------------------------------------------------------------------------
+    def delta_events(self, record, timestamp):
+        """This method returns a delta event holding the numeric values that moved beyond epsilon, if any
+        """
+        changes = {}
+
+        for key in RATIO_KEYS + PUPIL_KEYS:
+            value = record.get(key)
+            last  = self.last_values.get(key)
+
+            if value is None or last is None:
+                changed = (value is None) != (last is None) or key not in self.last_values
+            elif key in PUPIL_KEYS:
+                changed = max(abs(value[0] - last[0]), abs(value[1] - last[1])) > self.pixel_epsilon
+            else:
+                changed = abs(value - last) > self.epsilon
+
+            if changed:
+                changes[key]          = value
+                self.last_values[key] = value
+
+        if not changes:
+            return []
+
+        self.counters['deltas'] += 1
+        return [{'type': 'delta', 'time': timestamp, 'values': changes}]
+
+#------------------------------------------------------------------------------
+    def emit(self, event):
+        """This method passes the event to the callback and to every subscribed queue.
+           When a subscriber queue is full its oldest event is dropped
+        """
+        if self.callback is not None:
+            self.callback(event)
+
+        for subscriber in list(self.subscribers):
+            while True:
+                try:
+                    subscriber.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+#------------------------------------------------------------------------------
+    def subscribe(self, max_size = 256):
+        """This method returns a new queue receiving all the following events
+        """
+        subscriber = queue.Queue(max_size)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+#------------------------------------------------------------------------------
+    def unsubscribe(self, subscriber):
+        """This method stops sending events to the given queue
+        """
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
@@ -0,0 +1,161 @@
+import time
+import numpy as np
+import cv2
+
+
+###############################################################################
+class GazeHeatmap():
+    """This class accumulates gaze positions into a fixed size 2D histogram updated in place.
+       Two modes are available:
+       'ratios' : bins the (horizontal ratio, vertical ratio) pairs of horizontal_vertical_blinking_gaze_ratios
+       'pupils' : bins the pupils centres (x, y) pixels of an image of the given image_size
+
+       With a half_life (seconds) the histogram decays exponentially so it shows the recent gaze only.
+       Partial histograms built by parallel workers are combined with merge (or +=).
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self, bins = (48, 64), mode = 'ratios', image_size = None, half_life = None, render_interval = 0.5):
+        """GazeHeatmap parameters:
+           bins : (rows, columns) of the histogram
+           mode : 'ratios' or 'pupils'
+           image_size : (width, height) of the images in 'pupils' mode
+           half_life : seconds after which an accumulated position weighs half, None to never decay
+           render_interval : minimum seconds between two renderings of an updated histogram
+        """
+
+        if mode not in ('ratios', 'pupils'):
+            raise ValueError("mode must be 'ratios' or 'pupils'")
+        if mode == 'pupils' and image_size is None:
+            raise ValueError("image_size is required in 'pupils' mode")
+
+        self.bins       = tuple(bins)
+        self.mode       = mode
+        self.image_size = image_size
+        self.half_life  = half_life
+        self.counts     = np.zeros(self.bins, dtype=np.float64)
+        self.last_time  = None
+        self.version    = 0        # incremented by every update, used to cache the rendered image
+        self.rendered   = None
+
+        self.render_interval = render_interval
+        self.render_time     = 0.0
+
+#------------------------------------------------------------------------------
+    def decay(self, timestamp):
+        """This method decays the histogram up to the given time (seconds)
+        """
+        if self.half_life is not None and self.last_time is not None and timestamp > self.last_time:
+            self.counts *= 0.5 ** ((timestamp - self.last_time) / self.half_life)
+            self.version += 1
+
+        if self.last_time is None or timestamp > self.last_time:
+            self.last_time = timestamp
+
+#------------------------------------------------------------------------------
+    def add(self, points, weights = None, timestamp = None):
+        """This method bins an (N, 2) array of (x, y) positions (ratios or pixels depending on the mode),
+           the positions outside the histogram range are ignored
+        """
+        self.decay(time.time() if timestamp is None else timestamp)
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.mode == 'pupils':
+            points = points / self.image_size
+
+        rows, columns = self.bins
+        ix     = np.floor(points[:, 0] * columns).astype(np.int64)
+        iy     = np.floor(points[:, 1] * rows).astype(np.int64)
+        inside = (ix >= 0) & (ix < columns) & (iy >= 0) & (iy < rows)
+
+        if weights is not None:
+            weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), inside.shape)[inside]
+
+        np.add.at(self.counts.reshape(-1), iy[inside] * columns + ix[inside], 1.0 if weights is None else weights)
+        self.version += 1
+
+#------------------------------------------------------------------------------
+    def add_record(self, record, timestamp = None):
+        """This method bins the ratios or the pupils centres of one record of GazeEstimation.get_gaze_record,
+           records without a face are ignored
+        """
+        if self.mode == 'ratios':
+            found  = record['hori_ratio'] is not None and record['vert_ratio'] is not None
+            points = [(record['hori_ratio'], record['vert_ratio'])] if found else []
+        else:
+            points = [pupil for pupil in (record['left_pupil'], record['right_pupil']) if pupil is not None]
+
+        if points:
+            self.add(points, timestamp = timestamp)
+
+#------------------------------------------------------------------------------
+    def merge(self, other):
+        """This method adds the histogram of another GazeHeatmap with the same bins and mode (e.g. from another worker)
+        """
+        if other.bins != self.bins or other.mode != self.mode:
+            raise ValueError("only heatmaps with the same bins and mode can be merged")
+
+        counts = other.counts
+        if self.half_life is not None and other.last_time is not None and self.last_time is not None:
+            # bring both histograms to the latest of their times before adding them
+            if other.last_time < self.last_time:
+                counts = counts * 0.5 ** ((self.last_time - other.last_time) / self.half_life)
+            else:
+                self.decay(other.last_time)
+        elif other.last_time is not None:
+            self.decay(other.last_time)
+
+        self.counts  += counts
+        self.version += 1
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+#------------------------------------------------------------------------------
+    def reset(self):
+        """This method clears the histogram
+        """
+        self.counts[:] = 0
+        self.last_time = None
+        self.version  += 1
+
+#------------------------------------------------------------------------------
+    def render(self, size, colormap = cv2.COLORMAP_JET, flip_x = False):
+        """This method returns the histogram as a BGR colormap image of the given (width, height) size.
+           flip_x mirrors the image horizontally (for mirrored displays).
+           The image is rendered again only when the parameters changed, or when the histogram changed
+           and render_interval seconds passed since the last rendering
+        """
+        key = (tuple(size), colormap, flip_x)
+        now = time.monotonic()
+
+        if self.rendered is not None and self.rendered[0] == key:
+            if self.rendered[1] == self.version or now - self.render_time < self.render_interval:
+                return self.rendered[2]
+
+        peak   = self.counts.max()
+        scaled = self.counts * (255.0 / peak) if peak > 0 else self.counts
+        image  = cv2.applyColorMap(scaled.astype(np.uint8), colormap)
+        image  = cv2.resize(image, tuple(size), interpolation = cv2.INTER_LINEAR)
+        if flip_x:
+            image = cv2.flip(image, 1)
+
+        self.rendered    = (key, self.version, image)
+        self.render_time = now
+        return image
+
+#------------------------------------------------------------------------------
+    def overlay(self, image, alpha = 0.4, region = None, flip_x = False, colormap = cv2.COLORMAP_JET):
+        """This method blends the heatmap in place over the given (xmin, ymin, xmax, ymax) region of the image
+           (the whole image by default) and returns the image
+        """
+        if region is None:
+            region = (0, 0, image.shape[1], image.shape[0])
+
+        xmin, ymin, xmax, ymax = region
+        roi     = image[ymin:ymax, xmin:xmax]
+        heatmap = self.render((xmax - xmin, ymax - ymin), colormap, flip_x)
+
+        cv2.addWeighted(heatmap, alpha, roi, 1 - alpha, 0, dst = roi)
+        return image
@@ -2,6 +2,14 @@ import numpy as np
 import math
 import cv2
 import mediapipe as mp
+from mediapipe.framework.formats import landmark_pb2
+from GazeOrientation.LandmarkBackends import get_default_backend
+from GazeOrientation.FaceRenderer import default_renderer
+from GazeOrientation.Preprocessing import mirror_landmarks
+
+
+# overlay layers of render_layers, in drawing order
+OVERLAY_LAYERS = ('contours', 'mesh', 'irises', 'eyes', 'pupils', 'gaze')
 
 
 ###############################################################################
@@ -11,57 +19,129 @@ class GazeEstimation():
     """
 
 #------------------------------------------------------------------------------
-    def __init__(self, input_image):
-        """GazeEstimation class requires one input which is the input image
+    def __init__(self, input_image, backend = None, model_image = None, mirrored = False, landmarks = None, cache = None,
+                 measure_size = None):
+        """GazeEstimation class requires one input which is the input (BGR) image the results are drawn on.
+           The optional backend (see LandmarkBackends) runs the landmark inference,
+           the shared MediaPipeBackend is used by default (looked up when the inference first runs).
+           The optional model_image is the RGB image given to the backend (see Preprocessing.FramePreprocessor),
+           it is converted from the input image by default. mirrored tells that the input image
+           is the mirror of the model image: the landmarks, pupils centres and ratios are computed on the model image
+           and mirrored only when they are drawn.
+           The optional landmarks (the landmarks attribute of a previous GazeEstimation) are reused instead of running
+           the inference, an empty list meaning that no face was detected.
+           The optional cache (see ResultCache) returns the landmarks and the gaze record of a model image seen before.
+           The optional measure_size is the (width, height) of the camera image when the input image is a downscaled
+           working image: the pupils centres, eyes bounding boxes and ratios are measured in camera pixels so that
+           they do not depend on the working resolution
         """
 
         self.input_image = input_image
+        self.backend     = backend
+        self.mirrored      = mirrored
+        self.measure_size  = tuple(measure_size) if measure_size is not None else input_image.shape[1::-1]
+        self.landmarks     = landmarks
+        self.landmark_list = None
+        self.cache         = cache
+        self.cache_key     = None
+        self.cache_entry   = None
+
+        if model_image is None:
+            model_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
+            if mirrored:
+                model_image = cv2.flip(model_image, 1)
+        self.model_image = model_image
+
+#------------------------------------------------------------------------------
+    def get_landmarks_array(self):
+        """This method returns the (478, 3) array of the normalised face landmarks, or None if no face was detected.
+           The inference runs once per GazeEstimation object, the result is reused by all the other methods
+        """
+
+        if self.landmarks is None:
+            if self.cache is not None:
+                self.cache_key, self.cache_entry = self.cache.get(self.model_image)
+
+            if self.cache_entry is not None:
+                landmarks = self.cache_entry['landmarks']
+            else:
+                # the default backend is only created when an inference is needed
+                if self.backend is None:
+                    self.backend = get_default_backend()
+                landmarks = self.backend.process_image(self.model_image)
+                if self.cache is not None:
+                    self.cache_entry = self.cache.put(self.cache_key, self.model_image, landmarks)
+
+            self.landmarks = landmarks if landmarks is not None and len(landmarks) else []
+
+        if len(self.landmarks):
+            return self.landmarks
+        return None
+
+#------------------------------------------------------------------------------
+    def get_display_landmarks(self):
+        """This method returns the (478, 3) array of the normalised face landmarks mapped to the input image
+           (mirrored if the input image is mirrored), or None if no face was detected
+        """
+
+        if self.mirrored:
+            return mirror_landmarks(self.get_landmarks_array())
+        return self.get_landmarks_array()
 
 #------------------------------------------------------------------------------        
     def extract_face_landmarks(self):
         """This method returns arrays of face landmarks, irises landmarks as follow:
-           landmarks, face_landmarks : represent all face landmarks where (face_landmarks = landmarks.landmark)
+           landmarks, face_landmarks : represent all face landmarks where (face_landmarks = landmarks.landmark),
+                                       the methods of this class use the array of get_landmarks_array instead
            irises_landmarks_pointer : represents the indexes of the irises landmarks inside the face_landmarks array
            left_eye_landmarks_pointer: represents the indexes of the lefet eye landmarks inside the face_landmarks array
            right_eye_landmarks_pointer: represents the indexes of the right eye landmarks inside the face_landmarks array
         """        
               
-        mp_face_mesh = mp.solutions.face_mesh
-        
-        with mp_face_mesh.FaceMesh(
-            max_num_faces            = 1,
-            refine_landmarks         = True,
-            min_detection_confidence = 0.5,
-            min_tracking_confidence  = 0.5) as face_mesh:
-        
-            results = face_mesh.process(self.input_image)
+        mp_face_mesh   = mp.solutions.face_mesh
+        face_landmarks = self.get_landmarks_array()
             
-            if results.multi_face_landmarks:
-                irises_landmarks_pointer    = mp_face_mesh.FACEMESH_IRISES
-                left_eye_landmarks_pointer  = mp_face_mesh.FACEMESH_LEFT_EYE   
-                right_eye_landmarks_pointer = mp_face_mesh.FACEMESH_RIGHT_EYE  
-                landmarks                   = results.multi_face_landmarks[0] 
-                face_landmarks              = landmarks.landmark
-                               
+        if face_landmarks is not None:
+            irises_landmarks_pointer    = mp_face_mesh.FACEMESH_IRISES
+            left_eye_landmarks_pointer  = mp_face_mesh.FACEMESH_LEFT_EYE   
+            right_eye_landmarks_pointer = mp_face_mesh.FACEMESH_RIGHT_EYE  
+
+            # the NormalizedLandmarkList is built once per object, the methods of this class only use the array
+            if self.landmark_list is None:
+                self.landmark_list = landmark_pb2.NormalizedLandmarkList(
+                    landmark = [landmark_pb2.NormalizedLandmark(x = x, y = y, z = z) for x, y, z in face_landmarks.tolist()])
+            landmarks                   = self.landmark_list
+            face_landmarks              = landmarks.landmark
                 
-            else:
-                print("No landmarks detected")
-                landmarks                   = []
-                face_landmarks              = []
-                irises_landmarks_pointer    = [] 
-                left_eye_landmarks_pointer  = [] 
-                right_eye_landmarks_pointer = [] 
+        else:
+            print("No landmarks detected")
+            landmarks                   = []
+            face_landmarks              = []
+            irises_landmarks_pointer    = [] 
+            left_eye_landmarks_pointer  = [] 
+            right_eye_landmarks_pointer = [] 
         return landmarks, face_landmarks, irises_landmarks_pointer, left_eye_landmarks_pointer, right_eye_landmarks_pointer
 
+#------------------------------------------------------------------------------
+    def get_measure_image(self):
+        """This method returns the input image, or an empty array of the measure size shape
+           (only its shape is used to denormalise the landmarks)
+        """
+
+        if self.measure_size == self.input_image.shape[1::-1]:
+            return self.input_image
+        return np.empty((self.measure_size[1], self.measure_size[0], 0), dtype=np.uint8)
+
 #------------------------------------------------------------------------------           
     def get_left_pupil_centre(self): 
         """This method returns the (x, y) point of the left eye pupil centre
         """ 
         
-        _, face_landmarks, irises_landmarks_pointer, _, _ = self.extract_face_landmarks()
-        image                                             = self.input_image.copy()
+        face_landmarks           = self.get_landmarks_array()
+        irises_landmarks_pointer = mp.solutions.face_mesh.FACEMESH_IRISES
+        image                    = self.get_measure_image()
         
-        if face_landmarks:
+        if face_landmarks is not None:
 
             irises_landmarks_pointer = list(irises_landmarks_pointer)   
             xt, yr                   = irises_landmarks_pointer[0] 
@@ -83,17 +163,17 @@ class GazeEstimation():
             """
 
             # Denormalise the extracted Four irises landmarks based on the input image dimensions        
-            yt = int(face_landmarks[yt].y * image.shape[0])
-            xt = int(face_landmarks[xt].x * image.shape[1])
+            yt = int(face_landmarks[yt, 1] * image.shape[0])
+            xt = int(face_landmarks[xt, 0] * image.shape[1])
         
-            yb = int(face_landmarks[yb].y * image.shape[0])
-            xb = int(face_landmarks[xb].x * image.shape[1])
+            yb = int(face_landmarks[yb, 1] * image.shape[0])
+            xb = int(face_landmarks[xb, 0] * image.shape[1])
         
-            yr = int(face_landmarks[yr].y * image.shape[0])
-            xr = int(face_landmarks[xr].x * image.shape[1])
+            yr = int(face_landmarks[yr, 1] * image.shape[0])
+            xr = int(face_landmarks[xr, 0] * image.shape[1])
         
-            yl = int(face_landmarks[yl].y * image.shape[0])
-            xl = int(face_landmarks[xl].x * image.shape[1])
+            yl = int(face_landmarks[yl, 1] * image.shape[0])
+            xl = int(face_landmarks[xl, 0] * image.shape[1])
         
             # the pupil centre (x, y) is the mean of the four irises landmarks
             pupil_x = int(np.mean([xt, xr, xl, xb]))
@@ -112,10 +192,11 @@ class GazeEstimation():
         """This method returns the (x, y) point of the left eye pupil centre
         """ 
         
-        _, face_landmarks, irises_landmarks_pointer, _, _ = self.extract_face_landmarks()
-        image                                       = self.input_image.copy()
+        face_landmarks           = self.get_landmarks_array()
+        irises_landmarks_pointer = mp.solutions.face_mesh.FACEMESH_IRISES
+        image                    = self.get_measure_image()
         
-        if face_landmarks:
+        if face_landmarks is not None:
             irises_landmarks_pointer = list(irises_landmarks_pointer)   
             xt, yr                   = irises_landmarks_pointer[2] 
             xb, yl                   = irises_landmarks_pointer[3]       
@@ -136,17 +217,17 @@ class GazeEstimation():
             """        
             
             # Denormalise the extracted Four irises landmarks based on the input image dimensions       
-            yt = int(face_landmarks[yt].y * image.shape[0])
-            xt = int(face_landmarks[xt].x * image.shape[1])
+            yt = int(face_landmarks[yt, 1] * image.shape[0])
+            xt = int(face_landmarks[xt, 0] * image.shape[1])
         
-            yb = int(face_landmarks[yb].y * image.shape[0])
-            xb = int(face_landmarks[xb].x * image.shape[1])
+            yb = int(face_landmarks[yb, 1] * image.shape[0])
+            xb = int(face_landmarks[xb, 0] * image.shape[1])
         
-            yr = int(face_landmarks[yr].y * image.shape[0])
-            xr = int(face_landmarks[xr].x * image.shape[1])
+            yr = int(face_landmarks[yr, 1] * image.shape[0])
+            xr = int(face_landmarks[xr, 0] * image.shape[1])
         
-            yl = int(face_landmarks[yl].y * image.shape[0])
-            xl = int(face_landmarks[xl].x * image.shape[1])
+            yl = int(face_landmarks[yl, 1] * image.shape[0])
+            xl = int(face_landmarks[xl, 0] * image.shape[1])
         
             # the pupil centre (x, y) is the mean of the four irises landmarks
             pupil_x = int(np.mean([xt, xr, xl, xb]))
@@ -164,63 +245,21 @@ class GazeEstimation():
         """This method returns the input image with face mesh plotted over it
         """ 
         
-        landmarks, _, _, _, _ = self.extract_face_landmarks()
-        
-        mp_drawing        = mp.solutions.drawing_utils
-        mp_drawing_styles = mp.solutions.drawing_styles
-        mp_face_mesh      = mp.solutions.face_mesh
-        image             = self.input_image.copy()
-        
-        mp_drawing.draw_landmarks(
-            image                   = image,
-            landmark_list           = landmarks,
-            connections             = mp_face_mesh.FACEMESH_TESSELATION,
-            landmark_drawing_spec   = None,
-            connection_drawing_spec = mp_drawing_styles
-            .get_default_face_mesh_tesselation_style())        
-        return image
+        return default_renderer.render(self.input_image, self.get_display_landmarks(), ['mesh'])
     
 #------------------------------------------------------------------------------    
     def plot_face_contours(self):    
         """This method returns the input image with face contours plotted over it
         """ 
         
-        landmarks, _, _, _, _ = self.extract_face_landmarks()
-        
-        mp_drawing        = mp.solutions.drawing_utils
-        mp_drawing_styles = mp.solutions.drawing_styles
-        mp_face_mesh      = mp.solutions.face_mesh
-        image             = self.input_image.copy()
-        
-        mp_drawing.draw_landmarks(
-            image                   = image,
-            landmark_list           = landmarks,
-            connections             = mp_face_mesh.FACEMESH_CONTOURS,
-            landmark_drawing_spec   = None,
-            connection_drawing_spec = mp_drawing_styles
-            .get_default_face_mesh_contours_style())
-        return image
+        return default_renderer.render(self.input_image, self.get_display_landmarks(), ['contours'])
 
 #------------------------------------------------------------------------------    
     def plot_irises_landmarks(self):    
         """This method returns the input image with irises contours plotted over it
         """ 
         
-        landmarks, _, _, _, _ = self.extract_face_landmarks()
-        
-        mp_drawing        = mp.solutions.drawing_utils
-        mp_drawing_styles = mp.solutions.drawing_styles
-        mp_face_mesh      = mp.solutions.face_mesh
-        image             = self.input_image.copy()
-        
-        mp_drawing.draw_landmarks(
-            image                   = image,
-            landmark_list           = landmarks,
-            connections             = mp_face_mesh.FACEMESH_IRISES,
-            landmark_drawing_spec   = None,
-            connection_drawing_spec = mp_drawing_styles
-            .get_default_face_mesh_iris_connections_style())        
-        return image
+        return default_renderer.render(self.input_image, self.get_display_landmarks(), ['irises'])
 
 
 
@@ -232,10 +271,33 @@ class GazeEstimation():
         left_pupil_x,  left_pupil_y  = self.get_left_pupil_centre()
         right_pupil_x, right_pupil_y = self.get_right_pupil_centre()
         
-        image = self.input_image.copy()
-        
         if left_pupil_x and left_pupil_y and right_pupil_x and right_pupil_y:
             image = self.plot_eyes_contours()                       
+            image = self.draw_pupils_centres(image)
+        else:
+            image = self.input_image.copy()
+        return image
+
+#------------------------------------------------------------------------------    
+    def draw_pupils_centres(self, image):    
+        """This method returns the given image (of the input image size) with (+) symbols drawn over the pupils centres
+        """
+        
+        left_pupil_x,  left_pupil_y  = self.get_left_pupil_centre()
+        right_pupil_x, right_pupil_y = self.get_right_pupil_centre()
+        
+        if left_pupil_x and left_pupil_y and right_pupil_x and right_pupil_y:
+            if self.measure_size != self.input_image.shape[1::-1]:
+                # the pupils centres are measured in camera pixels, scale them to the input image
+                scale_x, scale_y             = np.divide(self.input_image.shape[1::-1], self.measure_size)
+                left_pupil_x,  left_pupil_y  = int(left_pupil_x  * scale_x), int(left_pupil_y  * scale_y)
+                right_pupil_x, right_pupil_y = int(right_pupil_x * scale_x), int(right_pupil_y * scale_y)
+
+            if self.mirrored:
+                # the pupils centres are computed on the model image, mirror them onto the input image
+                left_pupil_x  = self.input_image.shape[1] - 1 - left_pupil_x
+                right_pupil_x = self.input_image.shape[1] - 1 - right_pupil_x
+
             image = self.plot_plus(image, left_pupil_x,  left_pupil_y)
             image = self.plot_plus(image, right_pupil_x, right_pupil_y)       
         return image
@@ -267,7 +329,7 @@ class GazeEstimation():
         left_pupil_x,  left_pupil_y  = self.get_left_pupil_centre()
         right_pupil_x, right_pupil_y = self.get_right_pupil_centre()
         
-        image      = self.input_image.copy()
+        image      = self.input_image
         text_image = np.zeros(image.shape)
         
         # paramters to set the font properties, colour, location of the pupil centres text 
@@ -292,31 +354,9 @@ class GazeEstimation():
 #------------------------------------------------------------------------------
     def plot_eyes_contours(self):    
         """This method returns the input image with both eyes contours plotted over it
-        """
+        """ 
         
-        landmarks, _, _, _, _ = self.extract_face_landmarks()
-        
-        mp_drawing            = mp.solutions.drawing_utils
-        mp_drawing_styles     = mp.solutions.drawing_styles
-        mp_face_mesh          = mp.solutions.face_mesh
-        image                 = self.input_image.copy()
-        
-        mp_drawing.draw_landmarks(
-            image                   = image,
-            landmark_list           = landmarks,
-            connections             = mp_face_mesh.FACEMESH_LEFT_EYE,
-            landmark_drawing_spec   = None,
-            connection_drawing_spec = mp_drawing_styles
-            .get_default_face_mesh_contours_style())
-        
-        mp_drawing.draw_landmarks(
-            image                   = image,
-            landmark_list           = landmarks,
-            connections             = mp_face_mesh.FACEMESH_RIGHT_EYE,
-            landmark_drawing_spec   = None,
-            connection_drawing_spec = mp_drawing_styles
-            .get_default_face_mesh_contours_style())
-        return image         
+        return default_renderer.render(self.input_image, self.get_display_landmarks(), ['eyes'])
 
 #------------------------------------------------------------------------------
     def get_eyes_boundingbox(self):    
@@ -324,10 +364,10 @@ class GazeEstimation():
         left_eye  bounding box    returned as [Ymin, Ymax, Xmin, Xmax]
         right_eye bounding box    returned as [Ymin, Ymax, Xmin, Xmax]
         """        
-        _, face_landmarks, _,  left_eye_landmarks_pointer, right_eye_landmarks_pointer = self.extract_face_landmarks()
-        image = self.input_image.copy()
+        face_landmarks = self.get_landmarks_array()
+        image          = self.get_measure_image()
         
-        if face_landmarks:
+        if face_landmarks is not None:
             """the index numbers 
             (386, 374, 362, 263)(Ymin, Ymax, Xmin, Xmax) and 
             (159, 145, 33, 133)(Ymin, Ymax, Xmin, Xmax)
@@ -335,17 +375,17 @@ class GazeEstimation():
             right eye coordinates respectively            
             """
             # Extract the bounding boxes pints and Denormalise them on the input image dimensions    
-            left_eye_miny = int(face_landmarks[386].y * image.shape[0])
-            left_eye_maxy = int(face_landmarks[374].y * image.shape[0])
+            left_eye_miny = int(face_landmarks[386, 1] * image.shape[0])
+            left_eye_maxy = int(face_landmarks[374, 1] * image.shape[0])
             
-            left_eye_minx = int(face_landmarks[362].x * image.shape[1])            
-            left_eye_maxx = int(face_landmarks[263].x * image.shape[1])
+            left_eye_minx = int(face_landmarks[362, 0] * image.shape[1])            
+            left_eye_maxx = int(face_landmarks[263, 0] * image.shape[1])
             
-            right_eye_miny = int(face_landmarks[159].y * image.shape[0])
-            right_eye_maxy = int(face_landmarks[145].y * image.shape[0])
+            right_eye_miny = int(face_landmarks[159, 1] * image.shape[0])
+            right_eye_maxy = int(face_landmarks[145, 1] * image.shape[0])
             
-            right_eye_minx = int(face_landmarks[33].x * image.shape[1])            
-            right_eye_maxx = int(face_landmarks[133].x * image.shape[1])
+            right_eye_minx = int(face_landmarks[33, 0] * image.shape[1])            
+            right_eye_maxx = int(face_landmarks[133, 0] * image.shape[1])
           
         else:
             left_eye_miny = []
@@ -408,12 +448,26 @@ class GazeEstimation():
             
             return hori_ratio, vert_ratio, blink_ratio_left_eye, blink_ratio_right_eye
 
+#------------------------------------------------------------------------------
+    def get_gaze_ratios(self):
+        """This method returns the ratios of horizontal_vertical_blinking_gaze_ratios as floats, with the missing ones
+           (no face detected) and the non-finite ones (a closed eye has a zero vertical range) as None
+        """
+
+        ratios = []
+        for ratio in self.horizontal_vertical_blinking_gaze_ratios():
+            value = None if isinstance(ratio, list) else float(ratio)
+            ratios.append(value if value is not None and math.isfinite(value) else None)
+        return tuple(ratios)
+
 #------------------------------------------------------------------------------ 
-    def estimate_gaze_direction(self):
-        """This method returns a black image with text indicating gaze direction written over it
+    def classify_gaze_direction(self):
+        """This method returns the text describing the gaze direction and the indexes used to pick it as follow:
+           text, blinking_condition, vert_gaze_condition, hori_gaze_condition
+           where each index is -1 when its condition is not met (see the gaze direction array below)
         """
-        
-        hori_ratio, vert_ratio, blink_ratio_left_eye, blink_ratio_right_eye = self.horizontal_vertical_blinking_gaze_ratios()
+
+        hori_ratio, vert_ratio, blink_ratio_left_eye, blink_ratio_right_eye = self.get_gaze_ratios()
         
         blink_condition = 0.3          # left/right eyes blink ratios: blinknig (<= 0.3), open (> 0.3)
         hori_gaze_range = [0.45, 0.55] # right direction (<= 0.45), left direction (>= 0.55), centre (else)
@@ -429,7 +483,8 @@ class GazeEstimation():
         vert_gaze_condition = -1
         
         #  Set indexes based on the computed horizontal, vertical, blinking ratios
-        if blink_ratio_left_eye and blink_ratio_right_eye:
+        #  (a ratio of 0.0 is a valid value, e.g. a fully closed eye, only None is missing)
+        if blink_ratio_left_eye is not None and blink_ratio_right_eye is not None:
             if       blink_ratio_left_eye <= blink_condition and not blink_ratio_right_eye <= blink_condition: 
                 blinking_condition = 0
             
@@ -440,7 +495,7 @@ class GazeEstimation():
                 blinking_condition = 1  
            
             else:   
-                if hori_ratio:                   
+                if hori_ratio is not None:                   
                     if   hori_ratio <= hori_gaze_range[0]:
                         hori_gaze_condition = 2
                     
@@ -449,7 +504,7 @@ class GazeEstimation():
                     
                     else:
                         hori_gaze_condition = 1
-                if vert_ratio:            
+                if vert_ratio is not None:            
                     if   vert_ratio <= vert_gaze_range[0]:
                         vert_gaze_condition = 0
                   
@@ -487,10 +542,47 @@ class GazeEstimation():
             else:
                 text = "..."
 
+        return text, blinking_condition, vert_gaze_condition, hori_gaze_condition
+
+#------------------------------------------------------------------------------ 
+    def get_gaze_record(self):
+        """This method returns a dictionary gathering the pupils centres, the gaze ratios and the gaze direction text.
+           Missing values (no face detected, or ratios that could not be computed) are returned as None
+        """
+
+        self.get_landmarks_array()
+        if self.cache_entry is not None and self.cache_entry['record'] is not None:
+            return dict(self.cache_entry['record'])
+
+        left_pupil_x,  left_pupil_y  = self.get_left_pupil_centre()
+        right_pupil_x, right_pupil_y = self.get_right_pupil_centre()
+        hori_ratio, vert_ratio, blink_ratio_left_eye, blink_ratio_right_eye = self.get_gaze_ratios()
+        text, _, _, _ = self.classify_gaze_direction()
+
+        record = {
+            'left_pupil':        [left_pupil_x, left_pupil_y]   if left_pupil_x and left_pupil_y   else None,
+            'right_pupil':       [right_pupil_x, right_pupil_y] if right_pupil_x and right_pupil_y else None,
+            'hori_ratio':        hori_ratio,
+            'vert_ratio':        vert_ratio,
+            'blink_ratio_left':  blink_ratio_left_eye,
+            'blink_ratio_right': blink_ratio_right_eye,
+            'direction':         text}
+
+        if self.cache_entry is not None:
+            self.cache.set_record(self.cache_key, dict(record))
+        return record
+
+#------------------------------------------------------------------------------ 
+    def estimate_gaze_direction(self):
+        """This method returns a black image with text indicating gaze direction written over it
+        """
+        
+        text, _, _, _ = self.classify_gaze_direction()
+
         
         
         # paramters to set the font properties, colour, location
-        image        = self.input_image.copy()
+        image        = self.input_image
         text_image   = np.zeros(image.shape)
         txt_location = (90, 60)        
         color        = (147, 58, 31)
@@ -508,70 +600,24 @@ class GazeEstimation():
            with arrows in side them pointong to the gize direction, or fully coloured to indicate eyes blinking.
         """
         
-        hori_ratio, vert_ratio, blink_ratio_left_eye, blink_ratio_right_eye = self.horizontal_vertical_blinking_gaze_ratios()
-        
-        blink_condition = 0.3          # left/right eyes blink ratios: blinknig (<= 0.3), open (> 0.3)
-        hori_gaze_range = [0.45, 0.55] # right direction (<= 0.45), left direction (>= 0.55), centre (else)
-        vert_gaze_range = [0.45, 0.55] # top direction (<= 0.45), bottom direction (>= 0.55), centre (else)        
-        
+        text_image = np.zeros(self.input_image.shape)
+        return self.draw_gaze_panel(text_image)
 
-        """ prepare indexes to pick the text that descibes the gaxe orientation from the gaze array below. 
-        This is based on the computed horizontal, vertical, blinking ratios
+#------------------------------------------------------------------------------
+    def draw_gaze_panel(self, text_image):
+        """This method returns the given image with the gaze direction panel of plot_gaze_direction drawn over it
+           (gaze direction text, eyes visualisation cirles and pupils centres text)
         """
-        # Initilise indexes to control the text and gaze visualisation 
-        blinking_condition  = -1
-        hori_gaze_condition = -1
-        vert_gaze_condition = -1
         
+        text, blinking_condition, vert_gaze_condition, hori_gaze_condition = self.classify_gaze_direction()
+        
+        # Initilise parameters to control the gaze visualisation 
         Lthickness = 1
         Rthickness = 1
         angle = '0'
         
         show_blinking_left  = [-1, -1, 1]
         show_blinking_right = [1, -1, -1]
-        
-        
-        
-        
-        
-        #  Set indexes based on the computed horizontal, vertical, blinking ratios
-        if blink_ratio_left_eye and blink_ratio_right_eye:
-            if       blink_ratio_left_eye <= blink_condition and not blink_ratio_right_eye <= blink_condition: 
-                blinking_condition = 0
-            
-            elif not blink_ratio_left_eye <= blink_condition and     blink_ratio_right_eye <= blink_condition:
-                blinking_condition = 2
-            
-            elif     blink_ratio_left_eye <= blink_condition and     blink_ratio_right_eye <= blink_condition:
-                blinking_condition = 1  
-           
-            else:   
-                if hori_ratio:                   
-                    if   hori_ratio <= hori_gaze_range[0]:
-                        hori_gaze_condition = 2
-                    
-                    elif hori_ratio >= hori_gaze_range[1]:
-                        hori_gaze_condition = 0
-                    
-                    else:
-                        hori_gaze_condition = 1
-                if vert_ratio:            
-                    if   vert_ratio <= vert_gaze_range[0]:
-                        vert_gaze_condition = 0
-                  
-                    elif vert_ratio >= vert_gaze_range[1]:
-                        vert_gaze_condition = 2
-                   
-                    else:
-                        vert_gaze_condition = 1
-      
-
-             
-        #  Gaze direction array
-        gaze_direction = (["Looking top left",     "Looking top",             "Looking top right"],
-                          ["Looking left",         "Looking centre",          "Looking right"],
-                          ["Looking bottom left",  "Looking bottom",          "Looking bottom right"],
-                          ["Left eye is blinking", "Boths eyes are blinking", "Right eye is blinking"])
 
         # the gaze angle array is used in ploting the arrows that visualise the gaze direction
         gaze_angle    = ([90 + 45,    90,        45],
@@ -579,36 +625,16 @@ class GazeEstimation():
                          [180 + 45,  270,  270 + 45],
                          ['0',       '0',       '0'])
         
-        
-        
-        """
-         0,0 | 0,1 | 0,2
-        -----------------
-         1,0 | 1,1 | 1,2
-        -----------------
-         2,0 | 2,1 | 2,2
-        -----------------
-         3,0 | 3,1 | 3,2
-        
-        """
-   
-        # pick the best text that descibes the gaze orientation using the prepared indexes
+        # pick the arrow angle or the blinking eyes using the indexes of the gaze direction text
         if blinking_condition > -1:
-            text = gaze_direction[3][blinking_condition]    
             Lthickness = show_blinking_left[blinking_condition]
             Rthickness = show_blinking_right[blinking_condition]
-        else:
-            if hori_gaze_condition> -1 and vert_gaze_condition > -1:
-                text  = gaze_direction[vert_gaze_condition][hori_gaze_condition]
-                angle = gaze_angle[vert_gaze_condition][hori_gaze_condition]
-            else:
-                text = "..."
+        elif hori_gaze_condition > -1 and vert_gaze_condition > -1:
+            angle = gaze_angle[vert_gaze_condition][hori_gaze_condition]
 
         
         
         # paramters to set the font properties, colour, location
-        image        = self.input_image.copy()
-        text_image   = np.zeros(image.shape)
         txt_location = (90, 60)        
         color        = (147, 58, 31)
         thickness    = 2
@@ -669,6 +695,25 @@ class GazeEstimation():
         return text_image
            
            
+#------------------------------------------------------------------------------
+    def render_layers(self, layers, out = None):
+        """This method returns the input image with the given overlay layers (see OVERLAY_LAYERS) composited over it
+           in a single pass, all the layers use the landmarks inferred once on the clean model image:
+           'contours', 'mesh', 'irises', 'eyes' : face mesh layers drawn by the FaceRenderer
+           'pupils' : (+) symbols over the pupils centres
+           'gaze' : gaze direction panel of plot_gaze_direction
+           The drawing is done into the optional out buffer (a new copy of the input image by default)
+        """
+        
+        mesh_layers = [layer for layer in OVERLAY_LAYERS if layer in layers and layer in default_renderer.layers]
+        image       = default_renderer.render(self.input_image, self.get_display_landmarks(), mesh_layers, out = out)
+        
+        if 'pupils' in layers:
+            image = self.draw_pupils_centres(image)
+        if 'gaze' in layers:
+            image = self.draw_gaze_panel(image)
+        return image
+
 #------------------------------------------------------------------------------
     def pol2cart(self, radius, angle):
         """ This method convert polar cordinates (radius, angle) to cartesian (x, y)
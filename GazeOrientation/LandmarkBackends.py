@@ -0,0 +1,355 @@
+import os
+import math
+import threading
+import numpy as np
+import cv2
+import mediapipe as mp
+
+
+# number of face landmarks (468 mesh landmarks + 2 x 5 irises landmarks) returned by every backend
+NUM_LANDMARKS = 478
+
+
+###############################################################################
+class LandmarkBackend():
+    """Base class of the landmark inference backends.
+       A backend receives a batch of N RGB images and returns an array of shape (N, 478, 3)
+       holding the normalised (x, y, z) face landmarks of the first face found in each image.
+       Images without a detected face have their rows filled with NaN.
+    """
+
+#------------------------------------------------------------------------------
+    def process(self, images):
+        """This method returns the (N, 478, 3) landmarks array of the given sequence of N RGB images
+        """
+        raise NotImplementedError
+
+#------------------------------------------------------------------------------
+    def process_image(self, image):
+        """This method returns the (478, 3) landmarks array of a single RGB image, or None if no face was detected
+        """
+        landmarks = self.process([image])[0]
+
+        if np.isnan(landmarks[0, 0]):
+            return None
+        return landmarks
+
+#------------------------------------------------------------------------------
+    def close(self):
+        """This method releases the resources held by the backend
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+###############################################################################
+class MediaPipeBackend(LandmarkBackend):
+    """Landmark backend running the MediaPipe FaceMesh solution.
+       One FaceMesh graph is created per backend and reused for every image,
+       images of a batch are processed one after the other.
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self, static_image_mode = False, min_detection_confidence = 0.5, min_tracking_confidence = 0.5):
+        """MediaPipeBackend uses the same FaceMesh settings as the original extract_face_landmarks method.
+           static_image_mode should be True when the images are not consecutive frames of one video stream
+        """
+
+        self.face_mesh = mp.solutions.face_mesh.FaceMesh(
+            static_image_mode        = static_image_mode,
+            max_num_faces            = 1,
+            refine_landmarks         = True,
+            min_detection_confidence = min_detection_confidence,
+            min_tracking_confidence  = min_tracking_confidence)
+
+        # the FaceMesh graph is not thread safe
+        self.lock = threading.Lock()
+
+#------------------------------------------------------------------------------
+    def process(self, images):
+        """This method returns the (N, 478, 3) landmarks array of the given sequence of N RGB images
+        """
+        landmarks = np.full((len(images), NUM_LANDMARKS, 3), np.nan, dtype=np.float32)
+
+        with self.lock:
+            for i, image in enumerate(images):
+                results = self.face_mesh.process(image)
+
+                if results.multi_face_landmarks:
+                    face_landmarks = results.multi_face_landmarks[0].landmark
+                    landmarks[i]   = [(lm.x, lm.y, lm.z) for lm in face_landmarks]
+        return landmarks
+
+#------------------------------------------------------------------------------
+    def close(self):
+        """This method releases the FaceMesh graph
+        """
+        self.face_mesh.close()
+
+
+###############################################################################
+class TFLiteBackend(LandmarkBackend):
+    """Landmark backend running the MediaPipe face landmark and iris landmark models directly
+       through a TFLite CPU interpreter (tflite-runtime, ai-edge-litert or tensorflow).
+       The number of intra-op threads is configurable and all the faces, then all the eyes,
+       of a batch go through the interpreters as one batched tensor.
+
+       Faces are located with an OpenCV Haar cascade, or with the landmarks of the previous
+       image when tracking is enabled (consecutive frames of one video stream).
+    """
+
+    face_input_size = 192
+    iris_input_size = 64
+
+    # longest side of the image given to the Haar cascade face detector
+    detection_size  = 160
+
+    # scale of the face region of interest relative to the detected face / landmarks box
+    face_roi_scale  = 1.5
+
+    # scale of the eye region of interest relative to the distance between the eye corners
+    eye_roi_scale   = 2.3
+
+    # (inner corner, outer corner) landmarks of the right and left eyes
+    right_eye_corners = (133, 33)
+    left_eye_corners  = (362, 263)
+
+#------------------------------------------------------------------------------
+    def __init__(self, num_threads = 1, tracking = False, min_presence_confidence = 0.5,
+                 refine_iterations = 1, face_model_path = None, iris_model_path = None):
+        """TFLiteBackend requires a TFLite interpreter package. The model files default to
+           the ones shipped inside the mediapipe package.
+        """
+
+        Interpreter  = self.import_interpreter()
+        modules_path = os.path.join(os.path.dirname(mp.__file__), 'modules')
+
+        if face_model_path is None:
+            face_model_path = os.path.join(modules_path, 'face_landmark', 'face_landmark.tflite')
+        if iris_model_path is None:
+            iris_model_path = os.path.join(modules_path, 'iris_landmark', 'iris_landmark.tflite')
+
+        self.face_interpreter = Interpreter(model_path = face_model_path, num_threads = num_threads)
+        self.iris_interpreter = Interpreter(model_path = iris_model_path, num_threads = num_threads)
+        self.batch_sizes      = {}
+
+        self.tracking                = tracking
+        self.min_presence_confidence = min_presence_confidence
+        self.refine_iterations       = refine_iterations
+        self.previous_landmarks      = None
+
+        self.face_detector = cv2.CascadeClassifier(
+            os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+        self.lock = threading.Lock()
+
+#------------------------------------------------------------------------------
+    @staticmethod
+    def import_interpreter():
+        """This method returns the first available TFLite Interpreter class
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                from ai_edge_litert.interpreter import Interpreter
+            except ImportError:
+                try:
+                    from tensorflow.lite import Interpreter
+                except ImportError:
+                    raise ImportError("TFLiteBackend requires tflite-runtime, ai-edge-litert or tensorflow")
+        return Interpreter
+
+#------------------------------------------------------------------------------
+    def process(self, images):
+        """This method returns the (N, 478, 3) landmarks array of the given sequence of N RGB images
+        """
+        landmarks = np.full((len(images), NUM_LANDMARKS, 3), np.nan, dtype=np.float32)
+
+        with self.lock:
+
+            # locate one face region of interest (centre x, centre y, size, angle) per image
+            rois = []
+            for image in images:
+                if self.tracking and self.previous_landmarks is not None:
+                    rois.append(self.landmarks_roi(self.previous_landmarks))
+                else:
+                    rois.append(self.detect_face_roi(image))
+
+            found = [i for i, roi in enumerate(rois) if roi is not None]
+
+            # run the face landmark model, then refine the region of interest from the landmarks
+            for iteration in range(self.refine_iterations + 1):
+                if not found:
+                    break
+                mesh, presence = self.run_face_model([images[i] for i in found], [rois[i] for i in found])
+
+                keep = []
+                for j, i in enumerate(found):
+                    if presence[j] >= self.min_presence_confidence:
+                        landmarks[i, :468] = mesh[j]
+                        rois[i]            = self.landmarks_roi(mesh[j])
+                        keep.append(i)
+                    else:
+                        landmarks[i] = np.nan
+                found = keep
+
+            # run the iris landmark model on both eyes of every face found
+            if found:
+                self.run_iris_model(images, landmarks, found)
+
+            if self.tracking:
+                self.previous_landmarks = landmarks[-1, :468].copy() if found and found[-1] == len(images) - 1 else None
+
+        # denormalise to the image dimensions as the FaceMesh solution does
+        for i in found:
+            height, width     = images[i].shape[:2]
+            landmarks[i, :, 0] /= width
+            landmarks[i, :, 1] /= height
+            landmarks[i, :, 2] /= width
+        return landmarks
+
+#------------------------------------------------------------------------------
+    def detect_face_roi(self, image):
+        """This method returns the region of interest (centre x, centre y, size, angle) of the largest face in the image
+        """
+        # the cascade runs on a downscaled gray image, faces smaller than 1/8 of the image are ignored
+        scale = min(1.0, self.detection_size / max(image.shape[:2]))
+        gray  = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        gray  = cv2.resize(gray, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+        faces = self.face_detector.detectMultiScale(gray, scaleFactor = 1.1, minNeighbors = 5,
+                                                    minSize = (min(gray.shape) // 8,) * 2)
+
+        if len(faces) == 0:
+            return None
+
+        x, y, w, h = np.array(max(faces, key = lambda face: face[2] * face[3])) / scale
+        return (x + w / 2, y + h / 2, self.face_roi_scale * max(w, h), 0.0)
+
+#------------------------------------------------------------------------------
+    def landmarks_roi(self, landmarks):
+        """This method returns the region of interest (centre x, centre y, size, angle) enclosing the given pixel mesh landmarks,
+           rotated so that the line between the outer eye corners is horizontal
+        """
+        xmin, ymin = landmarks[:468, :2].min(axis=0)
+        xmax, ymax = landmarks[:468, :2].max(axis=0)
+
+        dx, dy = landmarks[263, :2] - landmarks[33, :2]
+        angle  = math.atan2(dy, dx)
+
+        return ((xmin + xmax) / 2, (ymin + ymax) / 2, self.face_roi_scale * max(xmax - xmin, ymax - ymin), angle)
+
+#------------------------------------------------------------------------------
+    def roi_transform(self, roi, size):
+        """This method returns the 2x3 affine matrix mapping the pixels of a (size x size) crop to the image pixels
+        """
+        cx, cy, roi_size, angle = roi
+        scale    = roi_size / size
+        cos, sin = math.cos(angle) * scale, math.sin(angle) * scale
+
+        return np.array([[cos, -sin, cx - (cos * size - sin * size) / 2],
+                         [sin,  cos, cy - (sin * size + cos * size) / 2]], dtype=np.float32)
+
+#------------------------------------------------------------------------------
+    def crop(self, image, transform, size, out):
+        """This method writes the (size x size) crop described by the transform into out, scaled to [0, 1]
+        """
+        crop   = cv2.warpAffine(image, cv2.invertAffineTransform(transform), (size, size),
+                                flags = cv2.INTER_LINEAR, borderMode = cv2.BORDER_REPLICATE)
+        out[:] = crop * (1 / 255.0)
+
+#------------------------------------------------------------------------------
+    def invoke(self, interpreter, batch):
+        """This method runs the interpreter over a batch tensor and returns its outputs
+        """
+        input_index = interpreter.get_input_details()[0]['index']
+
+        if self.batch_sizes.get(id(interpreter)) != len(batch):
+            interpreter.resize_tensor_input(input_index, batch.shape)
+            interpreter.allocate_tensors()
+            self.batch_sizes[id(interpreter)] = len(batch)
+
+        interpreter.set_tensor(input_index, batch)
+        interpreter.invoke()
+        return [interpreter.get_tensor(output['index']) for output in interpreter.get_output_details()]
+
+#------------------------------------------------------------------------------
+    def run_face_model(self, images, rois):
+        """This method returns the (N, 468, 3) pixel mesh landmarks and the face presence scores of the given face regions
+        """
+        size       = self.face_input_size
+        batch      = np.empty((len(images), size, size, 3), dtype=np.float32)
+        transforms = [self.roi_transform(roi, size) for roi in rois]
+
+        for i, image in enumerate(images):
+            self.crop(image, transforms[i], size, batch[i])
+
+        mesh, presence = self.invoke(self.face_interpreter, batch)
+        mesh           = mesh.reshape(len(images), 468, 3)
+        presence       = 1 / (1 + np.exp(-presence.reshape(-1)))
+
+        # map the crop coordinates back to the image
+        for i, transform in enumerate(transforms):
+            mesh[i, :, :2] = mesh[i, :, :2] @ transform[:, :2].T + transform[:, 2]
+            mesh[i, :, 2] *= rois[i][2] / size
+        return mesh, presence
+
+#------------------------------------------------------------------------------
+    def run_iris_model(self, images, landmarks, found):
+        """This method fills the irises landmarks (468 - 477) of the faces found from their pixel mesh landmarks
+        """
+        size       = self.iris_input_size
+        batch      = np.empty((2 * len(found), size, size, 3), dtype=np.float32)
+        transforms = []
+        eye_depths = []
+
+        for j, i in enumerate(found):
+            for k, (inner, outer) in enumerate((self.right_eye_corners, self.left_eye_corners)):
+                inner_corner = landmarks[i, inner, :2]
+                outer_corner = landmarks[i, outer, :2]
+
+                dx, dy  = outer_corner - inner_corner if k else inner_corner - outer_corner
+                cx, cy  = (inner_corner + outer_corner) / 2
+                roi     = (cx, cy, self.eye_roi_scale * math.hypot(dx, dy), math.atan2(dy, dx))
+
+                transforms.append(self.roi_transform(roi, size))
+                eye_depths.append((landmarks[i, inner, 2] + landmarks[i, outer, 2]) / 2)
+                self.crop(images[i], transforms[-1], size, batch[2 * j + k])
+
+        # as in the MediaPipe iris graph, the 133 / 33 eye (image left side of an unmirrored face) goes through
+        # the model as it is and the 362 / 263 eye is mirrored, its irises left and right points swap when mirrored back
+        batch[1::2] = batch[1::2, :, ::-1]
+
+        _, irises = self.invoke(self.iris_interpreter, batch)
+        irises    = irises.reshape(-1, 5, 3)
+        irises[1::2, :, 0] = size - irises[1::2, :, 0]
+        irises[1::2, 1:5]  = irises[1::2, [3, 2, 1, 4]]
+
+        for j, i in enumerate(found):
+            for k, start in enumerate((468, 473)):
+                transform = transforms[2 * j + k]
+                iris      = irises[2 * j + k]
+
+                landmarks[i, start:start + 5, :2] = iris[:, :2] @ transform[:, :2].T + transform[:, 2]
+                landmarks[i, start:start + 5, 2]  = eye_depths[2 * j + k] + iris[:, 2] * np.hypot(*transform[:, 0])
+
+
+#------------------------------------------------------------------------------
+default_backend      = None
+default_backend_lock = threading.Lock()
+
+def get_default_backend():
+    """This function returns the static image MediaPipeBackend shared by the GazeEstimation objects created without a backend,
+       the results of an image never depend on the images processed before it.
+       Video streams should pass their own tracking backend (static_image_mode = False)
+    """
+    global default_backend
+
+    with default_backend_lock:
+        if default_backend is None:
+            default_backend = MediaPipeBackend(static_image_mode = True)
+    return default_backend
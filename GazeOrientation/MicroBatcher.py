@@ -0,0 +1,167 @@
+import time
+import queue
+import threading
+import collections
+import numpy as np
+from GazeOrientation.LandmarkBackends import MediaPipeBackend
+
+
+###############################################################################
+class MicroBatcher():
+    """This class groups the landmark requests of concurrent callers into micro-batches run by one warm backend.
+       A batch is started when max_batch images are waiting or when the oldest waiting request
+       has waited max_wait seconds, every batch goes through a single backend.process call.
+       The backend is created and warmed up once by the worker thread, on the first request.
+
+       The number of waiting images is bounded by max_queue: submit raises queue.Full beyond it,
+       so that the callers can reject the request instead of letting the latency grow.
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self, backend = None, max_batch = 8, max_wait = 0.01, max_queue = 64, history = 1024):
+        """MicroBatcher parameters:
+           backend : landmark backend, a static image MediaPipeBackend by default
+           max_batch : number of images that starts a batch without waiting
+           max_wait : seconds the oldest request waits for other requests to join its batch
+           max_queue : maximum number of waiting images
+           history : number of last requests the latency and throughput metrics are computed on
+        """
+
+        self.backend   = backend
+        self.max_batch = max_batch
+        self.max_wait  = max_wait
+        self.max_queue = max_queue
+
+        self.pending   = collections.deque()
+        self.queued    = 0          # number of images of the pending requests
+        self.condition = threading.Condition()
+        self.thread    = None
+
+        self.completed = collections.deque(maxlen = history)   # (end time, images, latency) of the last requests
+        self.counters  = {'requests': 0, 'images': 0, 'batches': 0, 'rejected': 0, 'errors': 0}
+
+#------------------------------------------------------------------------------
+    def start(self):
+        """This method starts the worker thread if it is not running yet
+        """
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.run, daemon = True)
+                self.thread.start()
+
+#------------------------------------------------------------------------------
+    def submit(self, images, timeout = None):
+        """This method returns the (N, 478, 3) landmarks array of the given N RGB images (NaN rows without a face).
+           It blocks until the batch holding the images was processed and raises queue.Full when too many images are waiting
+        """
+        self.start()
+        request = {'images': images, 'landmarks': None, 'error': None, 'time': time.perf_counter(),
+                   'done': threading.Event()}
+
+        with self.condition:
+            if self.queued + len(images) > self.max_queue:
+                self.counters['rejected'] += 1
+                raise queue.Full("{} images are already waiting".format(self.queued))
+
+            self.pending.append(request)
+            self.queued += len(images)
+            self.condition.notify()
+
+        if not request['done'].wait(timeout):
+            raise TimeoutError("the landmarks were not computed within {} seconds".format(timeout))
+        if request['error'] is not None:
+            raise request['error']
+        return request['landmarks']
+
+#------------------------------------------------------------------------------
+    def next_batch(self):
+        """This method waits for the next batch and returns its requests
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending)
+
+            # give the other requests max_wait seconds from the oldest one to join the batch
+            deadline = self.pending[0]['time'] + self.max_wait
+            while self.queued < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            # whole requests are taken until the batch is full, a larger request is a batch of its own
+            batch, images = [], 0
+            while self.pending and (not batch or images + len(self.pending[0]['images']) <= self.max_batch):
+                request  = self.pending.popleft()
+                images  += len(request['images'])
+                batch.append(request)
+
+            self.queued -= images
+            return batch
+
+#------------------------------------------------------------------------------
+    def run(self):
+        """This method runs the batches of the worker thread
+        """
+        if self.backend is None:
+            self.backend = MediaPipeBackend(static_image_mode = True)
+
+        # the first inference loads the model graph, it is paid here instead of by the first request
+        self.backend.process([np.zeros((64, 64, 3), dtype=np.uint8)])
+
+        while True:
+            batch  = self.next_batch()
+            images = [image for request in batch for image in request['images']]
+
+            try:
+                landmarks, error = self.backend.process(images), None
+            except Exception as exception:
+                landmarks, error = None, exception
+
+            end   = time.perf_counter()
+            start = 0
+            for request in batch:
+                count = len(request['images'])
+                if error is None:
+                    request['landmarks'] = landmarks[start:start + count]
+                else:
+                    request['error'] = error
+                start += count
+
+                with self.condition:
+                    self.counters['requests'] += 1
+                    self.counters['images']   += count
+                    self.counters['errors']   += error is not None
+                    self.completed.append((end, count, end - request['time']))
+                request['done'].set()
+
+            with self.condition:
+                self.counters['batches'] += 1
+
+#------------------------------------------------------------------------------
+    def report(self):
+        """This method returns the counters, the queue depth, the mean batch size,
+           the latency (milliseconds) and the throughput (images per second) of the last requests as a dictionary
+        """
+        with self.condition:
+            counters  = dict(self.counters)
+            completed = list(self.completed)
+            queued    = self.queued
+
+        report = {'counters':         counters,
+                  'queued_images':    queued,
+                  'mean_batch_size':  round(counters['images'] / counters['batches'], 3) if counters['batches'] else None,
+                  'latency_ms':       None,
+                  'images_per_second': None}
+
+        if completed:
+            latencies = np.array([latency for _, _, latency in completed]) * 1000
+            report['latency_ms'] = {'mean': round(float(latencies.mean()), 3),
+                                    'p50':  round(float(np.percentile(latencies, 50)), 3),
+                                    'p95':  round(float(np.percentile(latencies, 95)), 3),
+                                    'max':  round(float(latencies.max()), 3)}
+
+            # images completed between the start of the oldest request and the end of the last one
+            duration = completed[-1][0] - (completed[0][0] - completed[0][2])
+            if duration > 0:
+                report['images_per_second'] = round(sum(count for _, count, _ in completed) / duration, 3)
+        return report
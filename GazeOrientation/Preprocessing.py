@@ -0,0 +1,90 @@
+import numpy as np
+import cv2
+
+
+###############################################################################
+class FramePreprocessor():
+    """This class prepares every camera frame once for both the landmark inference and the display:
+       optional resize, BGR -> RGB conversion and mirroring are written into buffers allocated
+       on the first frame and reused for all the following frames of the same size.
+
+       The RGB model image is never mirrored (a mirrored face would swap the left and right eyes),
+       it is marked read-only so that MediaPipe can use it without copying it.
+       The landmarks computed on the model image are mapped to the display image with to_display.
+       With resize_model False only the display image is resized, the model image keeps the camera resolution
+       so that the landmarks do not depend on the working resolution.
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self, size = None, mirror = False, resize_model = True):
+        """FramePreprocessor parameters:
+           size : (width, height) working resolution, or None to keep the camera resolution
+           mirror : True to mirror the display image horizontally (selfie view)
+           resize_model : False to keep the model image at the camera resolution
+        """
+
+        self.size         = size
+        self.mirror       = mirror
+        self.resize_model = resize_model
+        self.buffers      = {}
+
+#------------------------------------------------------------------------------
+    def buffer(self, name, shape):
+        """This method returns the preallocated uint8 buffer of the given name, reallocated only when the shape changes
+        """
+        buffer = self.buffers.get(name)
+
+        if buffer is None or buffer.shape != shape:
+            buffer             = np.empty(shape, dtype=np.uint8)
+            self.buffers[name] = buffer
+
+        buffer.flags.writeable = True
+        return buffer
+
+#------------------------------------------------------------------------------
+    def process(self, frame):
+        """This method returns the (display_image, model_image) pair of the BGR camera frame:
+           display_image : BGR image at the working resolution, mirrored if requested
+           model_image : read-only RGB image at the working resolution (or the camera resolution), never mirrored
+
+           Both images are reused buffers overwritten by the next call
+        """
+
+        if not self.resize_model:
+            model_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst = self.buffer('rgb', frame.shape))
+            model_image.flags.writeable = False
+
+        if self.size is not None and frame.shape[1::-1] != tuple(self.size):
+            width, height = self.size
+            frame         = cv2.resize(frame, (width, height), dst = self.buffer('resized', (height, width, 3)),
+                                       interpolation = cv2.INTER_AREA)
+
+        if self.resize_model:
+            model_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst = self.buffer('rgb', frame.shape))
+            model_image.flags.writeable = False
+
+        if self.mirror:
+            display_image = cv2.flip(frame, 1, dst = self.buffer('display', frame.shape))
+        else:
+            display_image = frame
+        return display_image, model_image
+
+#------------------------------------------------------------------------------
+    def to_display(self, landmarks):
+        """This method returns the normalised landmarks of the model image mapped to the display image
+        """
+        if self.mirror:
+            return mirror_landmarks(landmarks)
+        return landmarks
+
+
+#------------------------------------------------------------------------------
+def mirror_landmarks(landmarks):
+    """This function returns a copy of the normalised landmarks mirrored horizontally
+    """
+    if landmarks is None or len(landmarks) == 0:
+        return landmarks
+
+    landmarks       = landmarks.copy()
+    landmarks[:, 0] = 1 - landmarks[:, 0]
+    return landmarks
@@ -0,0 +1,257 @@
+import json
+import sqlite3
+import hashlib
+import threading
+import collections
+import numpy as np
+import cv2
+
+
+# bytes counted for the gaze record of an entry
+RECORD_BYTES = 512
+
+
+###############################################################################
+class ResultCache():
+    """This class caches the landmarks (and the gaze record) computed for an image, so that an image
+       seen again does not pay the landmark inference again. Two kinds of keys are available:
+       'content' : exact hash of the image bytes, for still images submitted again
+       'frame' : hash of a small quantised grayscale thumbnail, for video frames of a static scene
+
+       In near-duplicate mode the frame is also compared with the last frame whose landmarks were computed (put):
+       when no pixel of their thumbnails differs by more than near_duplicate gray levels, its entry is reused.
+       Comparing with the computed frame rather than the previous one catches slow drifts, and at most
+       max_near_hits frames in a row reuse the same entry.
+       The largest difference is used instead of the mean one so that a small eye movement is never missed.
+
+       The memory used by the entries is bounded by max_bytes, the least recently used entries are evicted first.
+       Entries are dictionaries holding the 'landmarks' array (empty without a face) and the gaze 'record'
+       (see GazeEstimation.get_gaze_record, None until it is computed).
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self, key = 'content', max_bytes = 32 * 1024 * 1024, near_duplicate = None, thumbnail_size = (64, 48),
+                 max_near_hits = 30):
+        """ResultCache parameters:
+           key : 'content' or 'frame'
+           max_bytes : memory bound of the cached entries
+           near_duplicate : largest thumbnail difference (gray levels) of a near-duplicate frame, None to disable
+           thumbnail_size : (width, height) of the thumbnails used by the 'frame' keys and the near-duplicate mode
+           max_near_hits : maximum number of near-duplicate frames in a row reusing the same entry
+        """
+
+        if key not in ('content', 'frame'):
+            raise ValueError("key must be 'content' or 'frame'")
+
+        self.key            = key
+        self.max_bytes      = max_bytes
+        self.near_duplicate = near_duplicate
+        self.thumbnail_size = tuple(thumbnail_size)
+        self.max_near_hits  = max_near_hits
+
+        self.entries  = collections.OrderedDict()
+        self.nbytes   = 0
+        self.anchor     = None  # (thumbnail, entry) of the last computed frame in near-duplicate mode
+        self.near_count = 0     # near-duplicate frames in a row that reused the anchor entry
+        self.lock     = threading.Lock()
+        self.counters = {'hits': 0, 'near_hits': 0, 'misses': 0, 'evictions': 0}
+
+#------------------------------------------------------------------------------
+    def thumbnail(self, image):
+        """This method returns the small grayscale thumbnail of the image
+        """
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        return cv2.resize(gray, self.thumbnail_size, interpolation = cv2.INTER_AREA)
+
+#------------------------------------------------------------------------------
+    def make_key(self, image, thumbnail = None):
+        """This method returns the cache key of the image, the image shape is part of the key
+           since the gaze record holds pixel positions
+        """
+        digest = hashlib.blake2b(str(image.shape).encode(), digest_size = 16)
+
+        if self.key == 'content':
+            digest.update(np.ascontiguousarray(image).data)
+        else:
+            # the 2 lowest bits are dropped so that the sensor noise barely changes the key
+            digest.update(((thumbnail if thumbnail is not None else self.thumbnail(image)) >> 2).tobytes())
+        return digest.hexdigest()
+
+#------------------------------------------------------------------------------
+    def get(self, image):
+        """This method returns the (key, entry) pair of the image, the entry is None when the image is not cached
+        """
+        thumbnail = self.thumbnail(image) if self.key == 'frame' or self.near_duplicate is not None else None
+        key       = self.make_key(image, thumbnail)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+
+            elif self.near_duplicate is not None and self.anchor is not None and self.near_count < self.max_near_hits:
+                anchor_thumbnail, anchor_entry = self.anchor
+                if anchor_thumbnail.shape == thumbnail.shape and anchor_entry['shape'] == image.shape and \
+                   cv2.absdiff(anchor_thumbnail, thumbnail).max() <= self.near_duplicate:
+                    entry            = anchor_entry
+                    self.near_count += 1
+                    self.counters['near_hits'] += 1
+
+        if entry is None:
+            entry = self.load(key)
+            with self.lock:
+                self.counters['hits' if entry is not None else 'misses'] += 1
+                if entry is not None:
+                    self.insert(key, entry)
+        return key, entry
+
+#------------------------------------------------------------------------------
+    def put(self, key, image, landmarks, record = None):
+        """This method caches the landmarks (None or empty without a face) of the image of the given key
+           and returns the new entry
+        """
+        landmarks = np.empty((0, 3), dtype=np.float32) if landmarks is None else np.asarray(landmarks, dtype=np.float32)
+        entry     = {'landmarks': landmarks, 'record': record, 'shape': image.shape}
+
+        with self.lock:
+            self.insert(key, entry)
+        self.save(key, entry)
+
+        if self.near_duplicate is not None:
+            # the computed frame becomes the reference of the following near-duplicate frames
+            with self.lock:
+                self.anchor     = (self.thumbnail(image), entry)
+                self.near_count = 0
+        return entry
+
+#------------------------------------------------------------------------------
+    def set_record(self, key, record):
+        """This method adds the gaze record to the cached entry of the given key
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry['record'] = record
+        self.save(key, entry)
+
+#------------------------------------------------------------------------------
+    def insert(self, key, entry):
+        """This method adds the entry and evicts the least recently used entries beyond max_bytes (lock held)
+        """
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)['landmarks'].nbytes + RECORD_BYTES
+
+        self.entries[key] = entry
+        self.nbytes      += entry['landmarks'].nbytes + RECORD_BYTES
+
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted   = self.entries.popitem(last = False)
+            self.nbytes -= evicted['landmarks'].nbytes + RECORD_BYTES
+            self.counters['evictions'] += 1
+
+#------------------------------------------------------------------------------
+    def load(self, key):
+        """This method returns the entry of the given key from a secondary storage, None for the memory only cache
+        """
+        return None
+
+#------------------------------------------------------------------------------
+    def save(self, key, entry):
+        """This method writes the entry to a secondary storage, nothing for the memory only cache
+        """
+        pass
+
+#------------------------------------------------------------------------------
+    def clear(self):
+        """This method removes all the entries held in memory
+        """
+        with self.lock:
+            self.entries.clear()
+            self.nbytes   = 0
+            self.anchor     = None
+            self.near_count = 0
+
+#------------------------------------------------------------------------------
+    def report(self):
+        """This method returns the counters, the hit rate, the number of entries and the memory used as a dictionary
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            entries  = len(self.entries)
+            nbytes   = self.nbytes
+
+        lookups = counters['hits'] + counters['near_hits'] + counters['misses']
+        return {'counters': counters,
+                'hit_rate': round((counters['hits'] + counters['near_hits']) / lookups, 4) if lookups else None,
+                'entries':  entries,
+                'bytes':    nbytes}
+
+
+###############################################################################
+class PersistentResultCache(ResultCache):
+    """ResultCache whose entries are also written to an SQLite file, so that a rerun of a batch tool
+       over the same images skips the images already processed. The memory bound only applies to the
+       entries held in memory, the file keeps all the entries.
+    """
+
+#------------------------------------------------------------------------------
+    def __init__(self, path, key = 'content', max_bytes = 32 * 1024 * 1024, near_duplicate = None,
+                 thumbnail_size = (64, 48), max_near_hits = 30, commit_every = 64):
+        """PersistentResultCache creates (or reopens) the SQLite file at path,
+           the writes are committed every commit_every entries and on close
+        """
+        ResultCache.__init__(self, key, max_bytes, near_duplicate, thumbnail_size, max_near_hits)
+
+        self.path         = path
+        self.commit_every = commit_every
+        self.uncommitted  = 0
+        self.db_lock      = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                "(key TEXT PRIMARY KEY, shape TEXT, landmarks BLOB, record TEXT)")
+
+#------------------------------------------------------------------------------
+    def load(self, key):
+        """This method returns the entry of the given key read from the file, or None
+        """
+        with self.db_lock:
+            row = self.connection.execute("SELECT shape, landmarks, record FROM results WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        shape, landmarks, record = row
+        return {'landmarks': np.frombuffer(landmarks, dtype=np.float32).reshape(-1, 3),
+                'record':    json.loads(record) if record is not None else None,
+                'shape':     tuple(json.loads(shape))}
+
+#------------------------------------------------------------------------------
+    def save(self, key, entry):
+        """This method writes the entry to the file
+        """
+        record = json.dumps(entry['record']) if entry['record'] is not None else None
+
+        with self.db_lock:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                    (key, json.dumps(entry['shape']), entry['landmarks'].tobytes(), record))
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self.connection.commit()
+                self.uncommitted = 0
+
+#------------------------------------------------------------------------------
+    def close(self):
+        """This method commits the last entries and closes the file
+        """
+        with self.db_lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
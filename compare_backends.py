@@ -0,0 +1,101 @@
+import sys
+import argparse
+import time
+import cv2
+import numpy as np
+from GazeOrientation.LandmarkBackends import MediaPipeBackend, TFLiteBackend
+
+
+#------------------------------------------------------------------------------
+def load_images(paths, num_frames):
+    """This function returns a list of RGB images read from image files, or grabbed from the webcam if no path is given
+    """
+    images = []
+
+    if paths:
+        for path in paths:
+            image = cv2.imread(path)
+            if image is None:
+                print("Ignoring unreadable image:", path)
+                continue
+            images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    else:
+        webcam = cv2.VideoCapture(0)
+        while webcam.isOpened() and len(images) < num_frames:
+            success, image = webcam.read()
+            if success:
+                images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        webcam.release()
+    return images
+
+#------------------------------------------------------------------------------
+def throughput(backend, images, batch_size, repeats):
+    """This function returns the number of images per second processed by the backend
+    """
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    backend.process(batches[0])    # warm up
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for batch in batches:
+            backend.process(batch)
+    return repeats * len(images) / (time.perf_counter() - start)
+
+#------------------------------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(description = "Compare the landmarks and throughput of the MediaPipe and TFLite backends")
+    parser.add_argument('images', nargs = '*', help = "image files (webcam frames are used if none is given)")
+    parser.add_argument('--frames',      type = int, default = 32, help = "number of webcam frames to grab")
+    parser.add_argument('--threads',     type = int, default = 1,  help = "TFLite intra-op threads")
+    parser.add_argument('--batch-sizes', type = int, nargs = '+', default = [1, 8], help = "TFLite batch sizes to time")
+    parser.add_argument('--repeats',     type = int, default = 3,  help = "timed passes over the images")
+    parser.add_argument('--max-error',   type = float, default = None,
+                        help = "fail (exit status 1) when the mean mesh or irises error exceeds this number of pixels")
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.frames)
+    if not images:
+        print("No images to process")
+        return 1
+
+    mediapipe_backend = MediaPipeBackend(static_image_mode = True)
+    tflite_backend    = TFLiteBackend(num_threads = args.threads)
+
+    # parity: mean and max distance in pixels between the landmarks of both backends
+    reference = mediapipe_backend.process(images)
+    candidate = tflite_backend.process(images)
+
+    both  = ~np.isnan(reference[:, 0, 0]) & ~np.isnan(candidate[:, 0, 0])
+    sizes = np.array([image.shape[1::-1] for image in images], dtype=np.float32)[:, None, :]
+    error = np.linalg.norm((reference[..., :2] - candidate[..., :2]) * sizes, axis = -1)[both]
+
+    print("Faces found: MediaPipe {}/{}, TFLite {}/{}".format(
+        int((~np.isnan(reference[:, 0, 0])).sum()), len(images),
+        int((~np.isnan(candidate[:, 0, 0])).sum()), len(images)))
+    if both.any():
+        print("Mesh   landmarks error (pixels): mean {:.2f}, max {:.2f}".format(error[:, :468].mean(), error[:, :468].max()))
+        print("Irises landmarks error (pixels): mean {:.2f}, max {:.2f}".format(error[:, 468:].mean(), error[:, 468:].max()))
+
+    if args.max_error is not None:
+        if not both.any():
+            print("Parity check failed: no face found by both backends")
+            return 1
+        if max(error[:, :468].mean(), error[:, 468:].mean()) > args.max_error:
+            print("Parity check failed: mean error above {:.2f} pixels".format(args.max_error))
+            return 1
+
+    # throughput
+    print("MediaPipe:            {:8.1f} images/s".format(throughput(mediapipe_backend, images, 1, args.repeats)))
+    for batch_size in args.batch_sizes:
+        print("TFLite (batch {:3d}):   {:8.1f} images/s".format(
+            batch_size, throughput(tflite_backend, images, batch_size, args.repeats)))
+
+    mediapipe_backend.close()
+    tflite_backend.close()
+    return 0
+
+
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import argparse
+import os
+from GazeOrientation.EyePatchExporter import EyePatchExporter
+from GazeOrientation.ResultCache import PersistentResultCache
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+#------------------------------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(description = "Export aligned eye patches and gaze labels to memory-mapped .npy files")
+    parser.add_argument('sources', nargs = '+', help = "video files or image files")
+    parser.add_argument('--output',     default = 'eye_patches', help = "output files prefix")
+    parser.add_argument('--patch-size', type = int, nargs = 2, default = [36, 60], metavar = ('HEIGHT', 'WIDTH'))
+    parser.add_argument('--grayscale',  action = 'store_true', help = "store single channel patches")
+    parser.add_argument('--step',       type = int, default = 1, help = "export every step-th video frame")
+    parser.add_argument('--chunk-size', type = int, default = 1024, help = "number of frames the files grow by")
+    parser.add_argument('--cache',      help = "SQLite file caching the landmarks, a rerun skips the inference of the frames already seen")
+    args = parser.parse_args()
+
+    images = [source for source in args.sources if os.path.splitext(source)[1].lower() in IMAGE_EXTENSIONS]
+    videos = [source for source in args.sources if source not in images]
+
+    cache = PersistentResultCache(args.cache) if args.cache else None
+
+    with EyePatchExporter(args.output, args.patch_size, args.grayscale, chunk_size = args.chunk_size, cache = cache) as exporter:
+        for video in videos:
+            print("{}: {} frames exported".format(video, exporter.export_video(video, args.step)))
+
+        if images:
+            print("{} of {} images exported".format(exporter.export_images(images), len(images)))
+
+    if cache is not None:
+        print("Landmark cache:", cache.report())
+        cache.close()
+
+    print("{} frames written to {}_patches.npy and {}_labels.npy".format(exporter.labels.count, args.output, args.output))
+
+
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
 import cv2
 from GazeOrientation.GazeTracking import GazeEstimation
+from GazeOrientation.LandmarkBackends import MediaPipeBackend
+from GazeOrientation.Preprocessing import FramePreprocessor
+from GazeOrientation.AdaptiveScheduler import AdaptiveScheduler
+from GazeOrientation.ResultCache import ResultCache
 
 
 #------------------------------------------------------------------------------
@@ -11,6 +15,20 @@ def main():
     webcam.set(3, 1640)    # width
     webcam.set(4, 1420)    # height
     webcam.set(10, 100)    # brightness
+
+    # mirror the display once per frame, the model image is converted to RGB into a reused buffer
+    preprocessor = FramePreprocessor(mirror = True, resize_model = False)
+
+    # the webcam frames are consecutive frames of one stream, FaceMesh tracks the face between them
+    backend = MediaPipeBackend(static_image_mode = False)
+
+    # keep every frame within the camera frame period: reuse landmarks or lower the resolution when late
+    # the preprocessing converts and resizes the full camera frame at every level, its cost does not scale
+    scheduler = AdaptiveScheduler(budget = 1 / 30, expensive_layers = (), fixed_stages = ('preprocess',))
+    landmarks = None
+
+    # a static scene reuses the landmarks of the previous frame instead of running the inference again
+    frame_cache = ResultCache(key = 'frame', near_duplicate = 8)
     
     while webcam.isOpened():
         
@@ -19,14 +37,30 @@ def main():
             print("Ignoring empty camera frame.")
             # If loading a video, use 'break' instead of 'continue'.
             continue
-        estimate_gaze = GazeEstimation(image)
-        image1        = estimate_gaze.plot_pupils_centres()        
-        text_image    = estimate_gaze.plot_gaze_direction()
-        image         = cv2.flip(image1, 1) +  text_image
-        image0        = cv2.normalize(image, None, 0, 1.0, cv2.NORM_MINMAX, dtype = cv2.CV_32F)
+        camera_size       = image.shape[1::-1]
+        plan              = scheduler.start_frame(camera_size, reusable = landmarks is not None)
+        preprocessor.size = plan['size']
+
+        with scheduler.stage('preprocess'):
+            image, model_image = preprocessor.process(image)
+
+        estimate_gaze = GazeEstimation(image, backend = backend, model_image = model_image, mirrored = True,
+                                       landmarks = None if plan['infer'] else landmarks, cache = frame_cache,
+                                       measure_size = camera_size)
+        if plan['infer']:
+            with scheduler.stage('inference'):
+                estimate_gaze.get_landmarks_array()
+        landmarks = estimate_gaze.landmarks
+
+        with scheduler.stage('render'):
+            image1        = estimate_gaze.plot_pupils_centres()        
+            text_image    = estimate_gaze.plot_gaze_direction()
+            image         = image1 +  text_image
+            image0        = cv2.normalize(image, None, 0, 1.0, cv2.NORM_MINMAX, dtype = cv2.CV_32F)
       
            
         cv2.imshow('Gaze estimation project', image0)
+        scheduler.end_frame()
 
        
     
@@ -36,6 +70,9 @@ def main():
 
     webcam.release()
     cv2.destroyAllWindows()
+    backend.close()
+    print("Scheduler decisions:", scheduler.report()['counters'])
+    print("Frame cache:", frame_cache.report())
 
 
 #------------------------------------------------------------------------------
@@ -1,17 +1,36 @@
 import datetime, time
 import os
+import json
+import queue
+import uuid
 import cv2
-from flask import Flask, render_template, Response, request
-from threading import Thread
+import numpy as np
+from flask import Flask, render_template, Response, request, session
+from threading import Thread, Condition, Lock
 from GazeOrientation.GazeTracking import GazeEstimation
+from GazeOrientation.LandmarkBackends import MediaPipeBackend
+from GazeOrientation.GazeEvents import GazeEventEmitter
+from GazeOrientation.Preprocessing import FramePreprocessor
+from GazeOrientation.GazeHeatmap import GazeHeatmap
+from GazeOrientation.AdaptiveScheduler import AdaptiveScheduler
+from GazeOrientation.MicroBatcher import MicroBatcher
+from GazeOrientation.ResultCache import ResultCache
 
-global capture, rec_frame, gaze_direction, switch, face_contour, face_mesh, rec, out 
-capture        = 0
-gaze_direction = 0
-face_contour   = 0
-face_mesh      = 0
+global rec_frame, switch, rec, rec_layers, out 
 switch         = 1
 rec            = 0
+rec_layers     = frozenset()
+
+# overlay buttons of index.html: form field -> (button value, overlay layers toggled by the button)
+overlay_buttons = {
+    'gaze_direction': ('Estimate Gaze Direction', ('eyes', 'pupils', 'gaze')),
+    'face_contour':   ('Show Face Contours',      ('contours',)),
+    'face_mesh':      ('Show Face mesh',          ('mesh',)),
+    'irises':         ('Show Irises',             ('irises',)),
+    'eyes_contour':   ('Show Eyes Contours',      ('eyes',)),
+    'pupils':         ('Show Pupils Centres',     ('pupils',)),
+    'heatmap':        ('Show Gaze Heatmap',       ('heatmap',)),
+}
 
 #make shots directory to save pics
 try:
@@ -21,9 +40,48 @@ except OSError as error:
 
 #Instatiate flask app  
 app = Flask(__name__, template_folder='./templates')
+app.secret_key = os.urandom(16)
+
+# limits of the /analyze requests: body size (larger requests get a 413 answer) and number of images per request
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+ANALYZE_MAX_IMAGES               = 16
+ANALYZE_TIMEOUT                  = 30
 
 webcam = cv2.VideoCapture(0)
 
+# change-only gaze events streamed by /gaze_events
+gaze_events = GazeEventEmitter()
+
+# gaze ratios of the last minutes accumulated while the camera runs, shown by the 'heatmap' layer
+gaze_heatmap = GazeHeatmap(mode = 'ratios', half_life = 30)
+
+# the frames are mirrored once for display, the landmarks are computed on the RGB unmirrored frame
+preprocessor = FramePreprocessor(mirror = True, resize_model = False)
+
+# the webcam frames are consecutive frames of one stream, FaceMesh tracks the face between them
+webcam_backend = MediaPipeBackend(static_image_mode = False)
+
+# per frame latency budget of the capture thread: drops the mesh, reuses landmarks or lowers the resolution when late,
+# the preprocessing converts and resizes the full camera frame at every level, its cost does not scale
+scheduler = AdaptiveScheduler(budget = 1 / 20, fixed_stages = ('preprocess',))
+
+# the /analyze requests of all the clients share one warm static image backend through micro-batches
+analyze_batcher = MicroBatcher(max_batch = 8, max_wait = 0.01, max_queue = 64)
+
+# results of the images submitted before (exact content) and of the static webcam scenes (near-duplicate frames)
+analyze_cache = ResultCache(key = 'content')
+frame_cache   = ResultCache(key = 'frame', near_duplicate = 8)
+
+# state of every viewer session: active overlay layers, number of open video feeds, pending capture, last request time
+viewers        = {}
+VIEWER_TIMEOUT = 600
+
+# latest frame id and JPEG images (one per distinct set of layers) shared by all the video feeds
+frames         = {'id': 0, 'jpegs': {}}
+frames_ready   = Condition()
+capture_thread = None
+capture_lock   = Lock()
+
 #------------------------------------------------------------------------------
 def record(out):
     global rec_frame
@@ -32,49 +90,134 @@ def record(out):
         out.write(rec_frame)
 
 #------------------------------------------------------------------------------
-def gen_frames():  # generate frame by frame from camera
-    global out, capture,rec_frame
+def get_viewer():
+    # the viewer state of the current session
+    now = time.time()
+
+    # the sessions without an open video feed that were not seen for VIEWER_TIMEOUT seconds are forgotten
+    for key, viewer in list(viewers.items()):
+        if viewer['feeds'] == 0 and now - viewer['seen'] > VIEWER_TIMEOUT:
+            viewers.pop(key, None)
+
+    if session.get('viewer') not in viewers:
+        session['viewer']          = uuid.uuid4().hex
+        viewers[session['viewer']] = {'layers': set(), 'feeds': 0, 'capture': 0}
+
+    viewer         = viewers[session['viewer']]
+    viewer['seen'] = now
+    return viewer
+
+#------------------------------------------------------------------------------
+def capture_frames():  # read, infer and composite every frame once for all the viewers
+    landmarks = None
     while True:
-        success, frame = webcam.read() 
-        if success:
-            if(face_contour):
-                estimate_gaze = GazeEstimation(frame)                
-                frame         = estimate_gaze.plot_face_contours()
-              
-            if(face_mesh):
-                estimate_gaze = GazeEstimation(frame)                
-                frame         = estimate_gaze.plot_face_mesh()
-       
-            if(gaze_direction):
-                estimate_gaze = GazeEstimation(frame)                
-                frame1        = estimate_gaze.plot_pupils_centres()
-                
-                frame3        = estimate_gaze.plot_gaze_direction()
-                frame         = cv2.flip(frame3, 1) +  frame1
-                frame         = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype = cv2.CV_32F)
-
-            if(capture):
-                capture = 0
-                now     = datetime.datetime.now()
-                p       = os.path.sep.join(['shots', "shot_{}.png".format(str(now).replace(":",''))])
-                cv2.imwrite(p, cv2.flip(frame,1))
-            
-            if(rec):
-                rec_frame = frame
-                frame     = cv2.putText(cv2.flip(frame,1),"Recording...", (0,25), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255),4)
-                frame     = cv2.flip(frame,1)
-            
-                
-            try:
-                ret, buffer = cv2.imencode('.jpg', cv2.flip(frame,1))
-                frame       = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            except Exception as e:
-                pass
-                
-        else:
-            pass
+        try:
+            landmarks = capture_frame(landmarks)
+        except Exception:
+            # a failing frame must not stop the thread, every video feed would wait forever
+            app.logger.exception("Frame capture failed")
+            landmarks = None
+            time.sleep(0.05)
+
+#------------------------------------------------------------------------------
+def capture_frame(landmarks):  # one frame of capture_frames, returns the landmarks the next frame may reuse
+    global rec_frame
+    watching   = [viewer for viewer in list(viewers.values()) if viewer['feeds'] > 0]
+    layer_sets = {frozenset(viewer['layers']) for viewer in watching}
+    if(rec):
+        layer_sets.add(rec_layers)
+
+    if not (switch and webcam.isOpened() and (layer_sets or gaze_events.subscribers)):
+        time.sleep(0.05)
+        return landmarks
+
+    success, frame = webcam.read() 
+    if not success:
+        return landmarks
+
+    camera_size       = frame.shape[1::-1]
+    plan              = scheduler.start_frame(camera_size, reusable = landmarks is not None)
+    preprocessor.size = plan['size']
+
+    # one inference on the clean frame (or the landmarks of the last one), shared by the events and all the overlay layers
+    with scheduler.stage('preprocess'):
+        frame, model_frame = preprocessor.process(frame)
+
+    estimate_gaze = GazeEstimation(frame, backend = webcam_backend, model_image = model_frame, mirrored = True,
+                                   landmarks = None if plan['infer'] else landmarks, cache = frame_cache,
+                                   measure_size = camera_size)
+    if plan['infer']:
+        with scheduler.stage('inference'):
+            estimate_gaze.get_landmarks_array()
+    landmarks = estimate_gaze.landmarks
+
+    gaze_record = estimate_gaze.get_gaze_record()
+    gaze_heatmap.add_record(gaze_record)
+    if(gaze_events.subscribers):
+        gaze_events.update(gaze_record)
+
+    jpegs = {}
+    for layers in layer_sets:
+        with scheduler.stage('render'):
+            image = estimate_gaze.render_layers(layers - plan['skip_layers'])
+            if 'heatmap' in layers:
+                # the heatmap panel in the bottom right corner, mirrored like the display
+                height, width = image.shape[:2]
+                gaze_heatmap.overlay(image, alpha = 0.6, region = (width - width // 3, height - height // 3, width, height), flip_x = True)
+
+        for viewer in watching:
+            if viewer['capture'] and frozenset(viewer['layers']) == layers:
+                viewer['capture'] = 0
+                now = datetime.datetime.now()
+                p   = os.path.sep.join(['shots', "shot_{}.png".format(str(now).replace(":",''))])
+                cv2.imwrite(p, image)
+
+        if(rec):
+            if layers == rec_layers:
+                # the video is written at 640x480 whatever the working resolution
+                rec_frame = image.copy() if image.shape[:2] == (480, 640) else cv2.resize(image, (640, 480))
+            image = cv2.putText(image,"Recording...", (0,25), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255),4)
+
+        with scheduler.stage('encode'):
+            ret, buffer   = cv2.imencode('.jpg', image)
+            jpegs[layers] = buffer.tobytes()
+
+    with frames_ready:
+        frames['id']    += 1
+        frames['jpegs']  = jpegs
+        frames_ready.notify_all()
+    scheduler.end_frame()
+    return landmarks
+
+#------------------------------------------------------------------------------
+def start_capture():
+    global capture_thread
+    with capture_lock:
+        if capture_thread is None:
+            capture_thread = Thread(target = capture_frames, daemon = True)
+            capture_thread.start()
+
+#------------------------------------------------------------------------------
+def gen_frames(viewer):  # generate frame by frame the overlays chosen by the viewer
+    viewer['feeds'] += 1
+    frame_id         = frames['id']
+    try:
+        while True:
+            with frames_ready:
+                if not frames_ready.wait_for(lambda: frames['id'] != frame_id, timeout = 1.0):
+                    continue
+                frame_id = frames['id']
+                frame    = frames['jpegs'].get(frozenset(viewer['layers']))
+
+            # the layers changed after the frame was composited, wait for the next one
+            if frame is None:
+                continue
+
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    finally:
+        viewer['feeds'] -= 1
+        viewer['seen']   = time.time()
 
 #------------------------------------------------------------------------------
 @app.route('/')
@@ -84,28 +227,111 @@ def index():
 #------------------------------------------------------------------------------    
 @app.route('/video_feed')
 def video_feed():
-    return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    start_capture()
+    return Response(gen_frames(get_viewer()), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+#------------------------------------------------------------------------------
+@app.route('/gaze_events')
+def gaze_events_stream():
+    # server-sent events: one JSON event per message
+    start_capture()
+    def stream():
+        events = gaze_events.subscribe()
+        try:
+            while True:
+                try:
+                    event = events.get(timeout = 15)
+                    yield 'data: ' + json.dumps(event) + '\n\n'
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+        finally:
+            gaze_events.unsubscribe(events)
+    return Response(stream(), mimetype='text/event-stream')
+
+#------------------------------------------------------------------------------
+@app.route('/metrics')
+def metrics():
+    # decisions and stage costs of the capture thread scheduler
+    return {'scheduler':     scheduler.report(),
+            'analyze':       analyze_batcher.report(),
+            'analyze_cache': analyze_cache.report(),
+            'frame_cache':   frame_cache.report()}
+
+#------------------------------------------------------------------------------
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    # gaze records of a single image (raw request body) or of a batch of images (multipart form files)
+    if request.files:
+        # every file of every field (a field may hold several files)
+        uploads = [(upload.filename, upload.read()) for _, upload in request.files.items(multi = True)]
+    else:
+        uploads = [(None, request.get_data())]
+
+    if not request.files and not uploads[0][1]:
+        return {'error': 'no image in the request'}, 400
+    if len(uploads) > ANALYZE_MAX_IMAGES:
+        return {'error': 'at most {} images per request'.format(ANALYZE_MAX_IMAGES)}, 413
+
+    images     = [cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None for _, data in uploads]
+    rgb_images = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images if image is not None]
+    if not request.files and not rgb_images:
+        return {'error': 'unreadable image'}, 400
+
+    # the images analysed before are answered from the cache, the others go through the micro-batches
+    cached  = [analyze_cache.get(rgb_image) for rgb_image in rgb_images]
+    missing = [rgb_image for rgb_image, (_, entry) in zip(rgb_images, cached) if entry is None]
+
+    try:
+        landmarks = analyze_batcher.submit(missing, ANALYZE_TIMEOUT) if missing else []
+    except queue.Full:
+        return {'error': 'too many images waiting, retry later'}, 503, {'Retry-After': '1'}
+    except TimeoutError:
+        return {'error': 'the images were not analysed in time'}, 503
+
+    results  = []
+    faces    = iter(landmarks)
+    analysed = iter(zip(rgb_images, cached))
+    for (name, data), image in zip(uploads, images):
+        if image is None:
+            results.append({'name': name, 'error': 'unreadable image' if data else 'empty file'})
+            continue
+
+        rgb_image, (key, entry) = next(analysed)
+        if entry is None:
+            face  = next(faces)
+            entry = analyze_cache.put(key, rgb_image, None if np.isnan(face[0, 0]) else face)
+
+        record = entry['record']
+        if record is None:
+            face          = entry['landmarks']
+            estimate_gaze = GazeEstimation(image, model_image = rgb_image, landmarks = face if len(face) else [])
+            record        = estimate_gaze.get_gaze_record()
+            analyze_cache.set_record(key, record)
+        results.append(dict(record, name = name))
+
+    if request.files:
+        return {'results': results}
+    del results[0]['name']
+    return results[0]
 
 #------------------------------------------------------------------------------
 @app.route('/requests',methods=['POST','GET'])
 def tasks():
     global switch,webcam
     if request.method == 'POST':
-        if request.form.get('gaze_direction') == 'Estimate Gaze Direction':
-            global gaze_direction
-            gaze_direction = not gaze_direction
- 
-        elif  request.form.get('face_contour') == 'Show Face Contours':
-            global face_contour
-            face_contour = not face_contour
+        viewer = get_viewer()
+        button = [name for name in overlay_buttons if request.form.get(name) == overlay_buttons[name][0]]
 
-        elif  request.form.get('face_mesh') == 'Show Face mesh':
-            global face_mesh
-            face_mesh = not face_mesh
+        if button:
+            # toggle the layers of the button for this viewer only
+            layers = set(overlay_buttons[button[0]][1])
+            if layers <= viewer['layers']:
+                viewer['layers'] = viewer['layers'] - layers
+            else:
+                viewer['layers'] = viewer['layers'] | layers
 
         elif  request.form.get('click') == 'Capture':
-            global capture
-            capture = 1               
+            viewer['capture'] = 1               
 
         elif  request.form.get('stop') == 'Stop/Start':
             
@@ -119,10 +345,11 @@ def tasks():
                 switch=1
  
         elif  request.form.get('rec') == 'Start/Stop Recording':
-            global rec, out
+            global rec, rec_layers, out
             rec= not rec
 
             if(rec):
+                rec_layers = frozenset(viewer['layers'])
                 now    = datetime.datetime.now() 
                 fourcc = cv2.VideoWriter_fourcc(*'XVID')
                 out    = cv2.VideoWriter('vid_{}.avi'.format(str(now).replace(":",'')), fourcc, 20.0, (640, 480))
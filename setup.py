@@ -18,4 +18,5 @@ setuptools.setup(
     license='MIT',
     packages=['GazeOrientation'],
     install_requires=['numpy', 'opencv-python', 'mediapipe'],
+    extras_require={'tflite': ['tflite-runtime']},
 ) 
\ No newline at end of file
@@ -0,0 +1,34 @@
+import numpy as np
+from GazeOrientation.FaceRenderer import FaceMeshRenderer
+
+
+#------------------------------------------------------------------------------
+def face_landmarks(x_offset):
+    """This function returns a (478, 3) landmarks array spread over a face box moved by x_offset
+    """
+    rng       = np.random.default_rng(0)
+    landmarks = np.zeros((478, 3), dtype=np.float32)
+    landmarks[:, 0] = rng.uniform(0.1, 0.4, 478) + x_offset
+    landmarks[:, 1] = rng.uniform(0.3, 0.7, 478)
+    return landmarks
+
+#------------------------------------------------------------------------------
+def test_dirty_only_follows_a_moving_face():
+    renderer = FaceMeshRenderer()
+    image    = np.random.default_rng(1).integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    out      = image.copy()
+
+    for x_offset in (0.0, 0.5, 0.25):
+        landmarks = face_landmarks(x_offset)
+        renderer.render(image, landmarks, ['mesh', 'contours'], out = out, dirty_only = True)
+        assert np.array_equal(out, renderer.render(image, landmarks, ['mesh', 'contours']))
+
+#------------------------------------------------------------------------------
+def test_dirty_only_erases_a_lost_face():
+    renderer = FaceMeshRenderer()
+    image    = np.random.default_rng(1).integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    out      = image.copy()
+
+    renderer.render(image, face_landmarks(0.3), ['mesh'], out = out, dirty_only = True)
+    renderer.render(image, None, ['mesh'], out = out, dirty_only = True)
+    assert np.array_equal(out, image)
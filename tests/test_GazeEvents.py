@@ -0,0 +1,45 @@
+import numpy as np
+from GazeOrientation.GazeTracking import GazeEstimation
+from GazeOrientation.GazeEvents import GazeEventEmitter
+
+
+#------------------------------------------------------------------------------
+def eyes_landmarks(closed):
+    """This function returns a (478, 3) landmarks array with both eyes open, or fully closed
+       (upper and lower lids on the same pixel row)
+    """
+    landmarks = np.full((478, 3), 0.5, dtype=np.float32)
+
+    for (top, bottom, inner, outer, irises), x in (((386, 374, 362, 263, range(473, 478)), 0.65),
+                                                   ((159, 145, 33, 133, range(468, 473)), 0.35)):
+        landmarks[[top, bottom], 0] = x
+        landmarks[top, 1]           = 0.42 if closed else 0.40
+        landmarks[bottom, 1]        = 0.42 if closed else 0.44
+        landmarks[inner]            = (x - 0.05, 0.42, 0.0)
+        landmarks[outer]            = (x + 0.05, 0.42, 0.0)
+        landmarks[list(irises), :2] = (x, 0.42)
+    return landmarks
+
+#------------------------------------------------------------------------------
+def test_closed_eyes_are_a_blink():
+    image  = np.zeros((480, 640, 3), dtype=np.uint8)
+    record = GazeEstimation(image, landmarks = eyes_landmarks(closed = True)).get_gaze_record()
+
+    assert record['blink_ratio_left'] == 0.0 and record['blink_ratio_right'] == 0.0
+    assert record['vert_ratio'] is None
+    assert record['direction'] == "Boths eyes are blinking"
+
+#------------------------------------------------------------------------------
+def test_closed_eyes_emit_blink_events():
+    image   = np.zeros((480, 640, 3), dtype=np.uint8)
+    emitter = GazeEventEmitter(debounce = 0.5)
+    events  = []
+
+    for timestamp, closed in enumerate([False] * 3 + [True] * 3 + [False] * 3):
+        record  = GazeEstimation(image, landmarks = eyes_landmarks(closed)).get_gaze_record()
+        events += emitter.update(record, timestamp = float(timestamp))
+
+    blinks = [event for event in events if event['type'] in ('blink_start', 'blink_end')]
+    assert [event['type'] for event in blinks] == ['blink_start', 'blink_end']
+    assert blinks[0]['eye'] == 'both' and blinks[0]['time'] == 3.0
+    assert blinks[1]['duration'] == 3.0